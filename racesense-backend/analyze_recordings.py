@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+# analyze_recordings.py
+#
+# Analisi in batch delle registrazioni (recordings/*/packets.jsonl).
+# Le gare vengono distribuite su un pool di processi; per ogni pilota calcola:
+# - tempi sul giro e split di settore S1/S2/S3 (stessa logica di Race.applyGPS in server.js)
+#   a partire dal primo passaggio sul traguardo; il tratto precedente è riportato come outLap
+# - intervalli fra pacchetti, buchi e stima dei pacchetti persi
+# - traccia velocità (media per secondo) e min/media/max
+# - qualità GPS (satelliti, distribuzione qual)
+#
+# I risultati sono salvati in cache per hash del contenuto (packets.jsonl,
+# config.json e file del circuito): rieseguendo su tutta la stagione vengono
+# processate solo le cartelle nuove o modificate.
+#
+# Uso:
+#   python3 analyze_recordings.py                       # tutte le gare in recordings/
+#   python3 analyze_recordings.py --jobs 8 --out stagione.json
+#   python3 analyze_recordings.py race_1762382423438_ye3oar_2025-11-05T22-40-23
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RECORDINGS_DIR = os.path.join(BASE_DIR, 'recordings')
+CIRCUITS_DIR = os.path.join(BASE_DIR, 'data', 'circuiti')
+CACHE_DIR = os.path.join(BASE_DIR, '.analysis_cache')
+
+# Da incrementare quando cambia il formato o la logica dei risultati: invalida la cache
+ANALYSIS_VERSION = 2
+
+R_EARTH = 6371000.0  # m
+
+# ---------- Geometria (come server.js) ----------
+def haversine_m(lat1, lon1, lat2, lon2):
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lon2 - lon1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon / 2) ** 2
+    return R_EARTH * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+def closest_sector(lat, lon, sectors, hint_idx):
+    """Porting di closestSector(): finestra locale attorno all'hint, fallback su scansione completa."""
+    n = len(sectors)
+    if not n:
+        return 0
+    w = min(25, n // 8)
+    best_idx, best = 0, math.inf
+
+    def scan(start, end):
+        nonlocal best_idx, best
+        for i in range(start, end + 1):
+            s = sectors[i % n]
+            d = haversine_m(lat, lon, s[0], s[1])
+            if d < best:
+                best, best_idx = d, i % n
+
+    if hint_idx is not None:
+        scan(hint_idx - w, hint_idx + w)
+        if best > 25:
+            scan(0, n - 1)
+    else:
+        scan(0, n - 1)
+    return best_idx
+
+# ---------- Analisi di una gara ----------
+class DriverAnalysis:
+    """Stato di replay per un singolo MAC."""
+
+    def __init__(self, mac, first_t):
+        self.mac = mac
+        self.packets = 0
+        self.last_t = None
+        self.gaps_ms = []
+        self.sector_idx = None
+        # giri e settori partono dal primo passaggio sul traguardo:
+        # il tratto precedente (uscita dai box, giro parziale) è l'out-lap
+        self.first_t = first_t
+        self.out_lap = None
+        self.lap_start = None
+        self.laps = []
+        self.zone = None
+        self.zone_start = None
+        self.cur_splits = {'S1': None, 'S2': None, 'S3': None}
+        self.splits = []
+        self.speed_buckets = {}
+        self.speed_min = math.inf
+        self.speed_max = -math.inf
+        self.speed_sum = 0.0
+        self.sats = []
+        self.qual_hist = {}
+
+    def apply(self, t, d, sectors, t0):
+        self.packets += 1
+        if self.last_t is not None:
+            self.gaps_ms.append(t - self.last_t)
+        self.last_t = t
+
+        speed = d.get('speedKmh') or 0.0
+        self.speed_min = min(self.speed_min, speed)
+        self.speed_max = max(self.speed_max, speed)
+        self.speed_sum += speed
+        sec = int((t - t0) // 1000)
+        b = self.speed_buckets.get(sec)
+        if b is None:
+            self.speed_buckets[sec] = [speed, 1]
+        else:
+            b[0] += speed
+            b[1] += 1
+
+        self.sats.append(d.get('sats') or 0)
+        q = str(d.get('qual') or 0)
+        self.qual_hist[q] = self.qual_hist.get(q, 0) + 1
+
+        if not sectors:
+            return
+        lat, lon = d.get('lat'), d.get('lon')
+        if lat is None or lon is None:
+            return
+        n = len(sectors)
+        idx = closest_sector(lat, lon, sectors, self.sector_idx)
+
+        # crossing linea start
+        if self.sector_idx is not None and self.sector_idx > n - 10 and idx < 10:
+            if self.lap_start is None:
+                self.out_lap = round((t - self.first_t) / 1000.0, 3)
+                self.lap_start = t
+                self.zone_start = t
+                self.zone = None
+            else:
+                lap_sec = (t - self.lap_start) / 1000.0
+                if lap_sec > 5:
+                    self.laps.append(round(lap_sec, 3))
+                    self.lap_start = t
+
+        # settori S1/S2/S3: tre parti uguali del tracciato
+        size = n // 3
+        zone = 'S1' if idx < size else ('S2' if idx < 2 * size else 'S3')
+        if self.zone and zone != self.zone and self.zone_start is not None:
+            self.cur_splits[self.zone] = round((t - self.zone_start) / 1000.0, 3)
+            self.zone_start = t
+            if self.zone == 'S3':
+                self.splits.append(self.cur_splits)
+                self.cur_splits = {'S1': None, 'S2': None, 'S3': None}
+        self.zone = zone
+        self.sector_idx = idx
+
+    def result(self, pilot):
+        gaps = sorted(self.gaps_ms)
+        median_gap = gaps[len(gaps) // 2] if gaps else None
+        lost = 0
+        big_gaps = 0
+        if median_gap:
+            for g in self.gaps_ms:
+                if g > 3 * median_gap:
+                    big_gaps += 1
+                    lost += int(round(g / median_gap)) - 1
+        sats = self.sats
+        return {
+            'mac': self.mac,
+            'pilot': pilot,
+            'packets': self.packets,
+            'outLap': self.out_lap,
+            'laps': self.laps,
+            'bestLap': min(self.laps) if self.laps else None,
+            'sectorSplits': self.splits,
+            'packetGaps': {
+                'medianMs': median_gap,
+                'p99Ms': gaps[min(len(gaps) - 1, int(len(gaps) * 0.99))] if gaps else None,
+                'maxMs': gaps[-1] if gaps else None,
+                'gapsOver3xMedian': big_gaps,
+                'estimatedLost': lost,
+                'estimatedLossRate': lost / (lost + self.packets) if self.packets else 0.0,
+            },
+            'speed': {
+                'min': self.speed_min if self.packets else None,
+                'avg': round(self.speed_sum / self.packets, 2) if self.packets else None,
+                'max': self.speed_max if self.packets else None,
+                # [secondo dall'inizio gara, velocità media km/h]
+                'trace': [[s, round(v[0] / v[1], 1)] for s, v in sorted(self.speed_buckets.items())],
+            },
+            'gpsQuality': {
+                'satsMin': min(sats) if sats else None,
+                'satsAvg': round(sum(sats) / len(sats), 2) if sats else None,
+                'satsMax': max(sats) if sats else None,
+                'qual': self.qual_hist,
+            },
+        }
+
+def analyze_recording(folder_path, circuit_path):
+    """Analizza una cartella di registrazione. Eseguita nei processi del pool."""
+    config = {}
+    config_path = os.path.join(folder_path, 'config.json')
+    if os.path.exists(config_path):
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = json.load(f).get('config') or {}
+
+    sectors = []
+    circuit_name = None
+    if circuit_path:
+        with open(circuit_path, 'r', encoding='utf-8') as f:
+            circuit = json.load(f)
+        sectors = [(s['lat'], s['lon']) for s in circuit.get('sectors') or []]
+        circuit_name = circuit.get('name')
+
+    pilots = {str(p.get('id')): f"{p.get('name', '')} {p.get('surname', '')}".strip()
+              for p in config.get('pilots') or []}
+    assignments = config.get('assignments') or {}
+
+    drivers = {}
+    t0 = t_last = None
+    bad_lines = 0
+    with open(os.path.join(folder_path, 'packets.jsonl'), 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                pkt = json.loads(line)
+                t, d = pkt['t'], pkt['d']
+                mac = d['mac']
+            except (ValueError, KeyError, TypeError):
+                bad_lines += 1
+                continue
+            if t0 is None:
+                t0 = t
+            t_last = t
+            drv = drivers.get(mac)
+            if drv is None:
+                drv = drivers[mac] = DriverAnalysis(mac, t)
+            drv.apply(t, d, sectors, t0)
+
+    results = [drv.result(pilots.get(str(assignments.get(mac)))) for mac, drv in drivers.items()]
+    results.sort(key=lambda r: (r['bestLap'] is None, r['bestLap'] or 0))
+    return {
+        'folder': os.path.basename(folder_path),
+        'circuitId': config.get('circuitId'),
+        'circuitName': circuit_name,
+        'durationSeconds': round((t_last - t0) / 1000.0, 1) if t0 is not None else 0,
+        'badLines': bad_lines,
+        'drivers': results,
+    }
+
+# ---------- Cache ----------
+def file_hash(path, h):
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+
+def content_hash(paths):
+    h = hashlib.sha256(f"v{ANALYSIS_VERSION}".encode())
+    for p in paths:
+        if p and os.path.exists(p):
+            h.update(os.path.basename(p).encode())
+            file_hash(p, h)
+    return h.hexdigest()
+
+def find_circuit(circuit_id, index):
+    """Come Race.start(): nome file senza estensione, altrimenti campo id nel JSON."""
+    if not circuit_id:
+        return None
+    if circuit_id in index:
+        return index[circuit_id]
+    for path in index.values():
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                if json.load(f).get('id') == circuit_id:
+                    index[circuit_id] = path
+                    return path
+        except (OSError, ValueError):
+            continue
+    return None
+
+def list_recordings(folders=None):
+    if folders:
+        return [os.path.join(RECORDINGS_DIR, f) for f in folders]
+    if not os.path.isdir(RECORDINGS_DIR):
+        return []
+    return sorted(os.path.join(RECORDINGS_DIR, f) for f in os.listdir(RECORDINGS_DIR)
+                  if os.path.isfile(os.path.join(RECORDINGS_DIR, f, 'packets.jsonl')))
+
+def circuit_index():
+    """Nome file senza estensione -> path dei circuiti in data/circuiti."""
+    index = {}
+    if not os.path.isdir(CIRCUITS_DIR):
+        return index
+    for f in os.listdir(CIRCUITS_DIR):
+        if f.lower().endswith('.json'):
+            index[os.path.splitext(f)[0]] = os.path.join(CIRCUITS_DIR, f)
+    return index
+
+def _circuit_id(folder):
+    try:
+        with open(os.path.join(folder, 'config.json'), 'r', encoding='utf-8') as f:
+            return (json.load(f).get('config') or {}).get('circuitId')
+    except (OSError, ValueError):
+        return None
+
+def run(folders, jobs, cache_dir, force=False):
+    os.makedirs(cache_dir, exist_ok=True)
+    index = circuit_index()
+
+    results = {}
+    todo = []
+    for folder in folders:
+        if not os.path.isfile(os.path.join(folder, 'packets.jsonl')):
+            print(f"⚠️  {os.path.basename(folder)}: nessun packets.jsonl, ignorata")
+            continue
+        circuit_path = find_circuit(_circuit_id(folder), index)
+        key = content_hash([os.path.join(folder, 'packets.jsonl'), os.path.join(folder, 'config.json'), circuit_path])
+        cache_path = os.path.join(cache_dir, key + '.json')
+        if not force and os.path.exists(cache_path):
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                results[folder] = json.load(f)
+        else:
+            todo.append((folder, circuit_path, cache_path))
+
+    print(f"[ANALISI] {len(folders)} gare | in cache: {len(results)} | da analizzare: {len(todo)} | processi: {jobs}")
+    t_start = time.perf_counter()
+    if todo:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = {pool.submit(analyze_recording, folder, circuit_path): (folder, cache_path)
+                       for folder, circuit_path, cache_path in todo}
+            for fut in as_completed(futures):
+                folder, cache_path = futures[fut]
+                try:
+                    res = fut.result()
+                except Exception as e:
+                    print(f"❌ {os.path.basename(folder)}: {e}")
+                    continue
+                # scrittura atomica: nessun file di cache parziale se interrotto
+                tmp = cache_path + '.tmp'
+                with open(tmp, 'w', encoding='utf-8') as f:
+                    json.dump(res, f)
+                os.replace(tmp, cache_path)
+                results[folder] = res
+                print(f"   ✅ {res['folder']} ({len(res['drivers'])} piloti)")
+    print(f"[ANALISI] Completata in {time.perf_counter() - t_start:.1f}s")
+    return [results[f] for f in folders if f in results]
+
+def print_summary(races):
+    for race in races:
+        print(f"\n📁 {race['folder']}  ({race.get('circuitName') or race.get('circuitId') or 'circuito N/A'}, "
+              f"{race['durationSeconds']}s)")
+        for d in race['drivers']:
+            name = d['pilot'] or d['mac']
+            best = f"{d['bestLap']:.3f}s" if d['bestLap'] else '—'
+            gaps = d['packetGaps']
+            print(f"   {name:<24} giri {len(d['laps']):>3} | best {best:>9} | "
+                  f"pkt {d['packets']:>6} | persi~ {gaps['estimatedLossRate']*100:5.2f}% | "
+                  f"gap max {gaps['maxMs'] or 0:>6} ms | v max {d['speed']['max'] or 0:5.1f} | "
+                  f"sats avg {d['gpsQuality']['satsAvg'] or 0:4.1f}")
+
+def main():
+    ap = argparse.ArgumentParser(description="Analisi parallela delle registrazioni di gara con cache dei risultati")
+    ap.add_argument('folders', nargs='*', help='Cartelle in recordings/ (default: tutte)')
+    ap.add_argument('--jobs', type=int, default=os.cpu_count() or 1,
+                    help='Numero di processi (default: CPU disponibili)')
+    ap.add_argument('--cache-dir', default=CACHE_DIR,
+                    help='Cartella cache risultati (default: .analysis_cache)')
+    ap.add_argument('--force', action='store_true', help='Ignora la cache e rianalizza tutto')
+    ap.add_argument('--out', default=None, help='Salva i risultati completi in JSON')
+    ap.add_argument('--quiet', action='store_true', help='Non stampare il riepilogo per pilota')
+    args = ap.parse_args()
+
+    if args.jobs <= 0:
+        print("❌ --jobs deve essere > 0", file=sys.stderr)
+        sys.exit(2)
+
+    folders = list_recordings(args.folders)
+    if not folders:
+        print('(nessuna gara registrata)')
+        return
+
+    races = run(folders, args.jobs, args.cache_dir, args.force)
+    if not args.quiet:
+        print_summary(races)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(races, f, indent=2)
+        print(f"\n[ANALISI] Risultati salvati in {args.out}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+# fleetsynth.py
+#
+# Sintesi di flotte numerose clonando tracce GPS reali registrate.
+# La registrazione (recordings/<gara>/packets.jsonl) viene letta una volta sola
+# in array compatti per pilota; ogni dispositivo virtuale è solo un riferimento
+# a una traccia più MAC nuovo, sfasamento temporale, piccola perturbazione
+# spaziale e fattore di velocità. I pacchetti mantengono rumore GPS, satelliti,
+# qual e cadenza di campionamento originali e passano dallo stesso percorso di
+# invio del simulatore (NetworkDelaySimulator → UDP, formato server.js).
+#
+# Le tracce vengono tagliate a giri interi (dal primo all'ultimo passaggio sul
+# traguardo del circuito della gara) e ripetute in loop senza salti di posizione.
+# Senza circuito, o con --keep-idle, ogni clone percorre la traccia una sola volta.
+#
+# Uso:
+#   python3 fleetsynth.py race_1762354836949_gkrkpb_2025-11-05T15-00-36 --devices 300
+#   python3 fleetsynth.py recordings/race_.../ --devices 500 --speed-spread 0.08 --duration 600
+#   python3 fleetsynth.py race_... --devices 200 --start-race http://localhost:5000
+
+import argparse
+import json
+import math
+import os
+import random
+import socket
+import sys
+import time
+from array import array
+
+from analyze_recordings import circuit_index, closest_sector, find_circuit
+from tracksimulator import NetworkDelaySimulator, meters_to_latlon_offset, random_mac, ts_yyMMddHHmmss_from_time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RECORDINGS_DIR = os.path.join(BASE_DIR, 'recordings')
+
+# sotto questa velocità il kart è fermo (box, griglia): testa e coda ferme vengono tagliate
+IDLE_KMH = 3.0
+
+# ---------- Tracce registrate ----------
+class DriverTrace:
+    """Traccia di un pilota in array compatti, condivisa da tutti i suoi cloni."""
+
+    __slots__ = ('mac', 't', 'lat', 'lon', 'sats', 'qual', 'speed', 'cpu', 'duration', 'lat0', 'loop', 'laps')
+
+    def __init__(self, mac, rows, lap_duration=None, laps=0):
+        """
+        rows: campioni (receivedAt ms, lat, lon, sats, qual, speedKmh, cpuTemp).
+        lap_duration: durata dei giri interi contenuti in rows; se indicata la traccia
+        è chiusa e viene ripetuta in loop, altrimenti è percorsa una volta sola.
+        """
+        self.mac = mac
+        self.loop = lap_duration is not None
+        self.laps = laps
+        t0 = rows[0][0]
+        self.t = array('d', ((r[0] - t0) / 1000.0 for r in rows))
+        self.lat = array('d', (r[1] for r in rows))
+        self.lon = array('d', (r[2] for r in rows))
+        self.sats = array('B', (min(255, max(0, r[3])) for r in rows))
+        self.qual = array('B', (min(255, max(0, r[4])) for r in rows))
+        self.speed = array('f', (r[5] for r in rows))
+        self.cpu = array('f', (r[6] for r in rows))
+        if self.loop:
+            # dopo l'ultimo campione segue il primo del giro successivo, allo stesso punto del traguardo
+            self.duration = lap_duration
+        else:
+            gaps = sorted(b - a for a, b in zip(self.t, self.t[1:]))
+            step = gaps[len(gaps) // 2] if gaps else 0.1
+            self.duration = self.t[-1] + max(step, 0.001)
+        self.lat0 = sum(self.lat) / len(self.lat)
+
+    def __len__(self):
+        return len(self.t)
+
+def resolve_recording(arg):
+    if os.path.isdir(arg):
+        return arg
+    path = os.path.join(RECORDINGS_DIR, arg)
+    if os.path.isdir(path):
+        return path
+    raise FileNotFoundError(f"Registrazione non trovata: {arg}")
+
+def load_sectors(cfg):
+    """Settori del circuito della gara (data/circuiti), lista vuota se non trovato."""
+    path = find_circuit((cfg.get('config') or {}).get('circuitId'), circuit_index())
+    if not path:
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        circuit = json.load(f)
+    return [(sc['lat'], sc['lon']) for sc in circuit.get('sectors') or []]
+
+def lap_crossings(rows, sectors):
+    """Indici dei campioni che passano sul traguardo (stessa regola di Race.applyGPS)."""
+    n = len(sectors)
+    out = []
+    prev = None
+    last_t = None
+    for i, r in enumerate(rows):
+        idx = closest_sector(r[1], r[2], sectors, prev)
+        if prev is not None and prev > n - 10 and idx < 10 and (last_t is None or r[0] - last_t > 5000):
+            out.append(i)
+            last_t = r[0]
+        prev = idx
+    return out
+
+def load_recording(folder, keep_idle=False, min_samples=50):
+    """
+    Legge packets.jsonl una volta sola e restituisce (config, [DriverTrace], [MAC scartati]).
+    Senza --keep-idle le tracce sono tagliate a giri interi; quelle senza un giro completo sono scartate.
+    """
+    cfg = {}
+    cfg_path = os.path.join(folder, 'config.json')
+    if os.path.exists(cfg_path):
+        with open(cfg_path, encoding='utf-8') as f:
+            cfg = json.load(f)
+
+    rows_by_mac = {}
+    with open(os.path.join(folder, 'packets.jsonl'), encoding='utf-8') as f:
+        for line in f:
+            try:
+                d = json.loads(line)['d']
+                lat, lon = float(d['lat']), float(d['lon'])
+            except (ValueError, KeyError, TypeError):
+                continue
+            if lat == 0 and lon == 0:
+                continue
+            cpu = d.get('cpuTemp')
+            rows_by_mac.setdefault(d['mac'], []).append((
+                float(d.get('receivedAt', 0)),
+                lat, lon,
+                int(d.get('sats') or 0),
+                int(d.get('qual') or 0),
+                float(d.get('speedKmh') or 0.0),
+                float(cpu) if cpu is not None else float('nan'),
+            ))
+
+    sectors = [] if keep_idle else load_sectors(cfg)
+    traces = []
+    dropped = []
+    for mac, rows in rows_by_mac.items():
+        rows.sort(key=lambda r: r[0])
+        if not keep_idle:
+            moving = [i for i, r in enumerate(rows) if r[5] >= IDLE_KMH]
+            rows = rows[moving[0]:moving[-1] + 1] if moving else []
+        if sectors:
+            cross = lap_crossings(rows, sectors)
+            if len(cross) < 2:
+                dropped.append(mac)
+                continue
+            first, last = cross[0], cross[-1]
+            # il campione dell'ultimo passaggio coincide (in posizione) col primo: è l'inizio del giro successivo
+            lap_rows = rows[first:last]
+            if len(lap_rows) >= min_samples:
+                traces.append(DriverTrace(mac, lap_rows, (rows[last][0] - rows[first][0]) / 1000.0, len(cross) - 1))
+            else:
+                dropped.append(mac)
+        elif len(rows) >= min_samples:
+            traces.append(DriverTrace(mac, rows))
+        else:
+            dropped.append(mac)
+    return cfg, traces, dropped
+
+# ---------- Dispositivi virtuali ----------
+class VirtualDevice:
+    """Clone di una traccia: solo parametri e cursore, nessuna copia dei dati."""
+
+    __slots__ = ('mac', 'trace', 'offset', 'scale', 'dlat', 'dlon', 'cursor', 'base', 'cpu_temp', 'done')
+
+    def __init__(self, mac, trace, offset, scale, dlat, dlon, cpu_temp):
+        self.mac = mac
+        self.trace = trace
+        self.offset = offset     # s di traccia all'avvio
+        self.scale = scale       # fattore di velocità (tempo di traccia per secondo reale)
+        self.dlat = dlat
+        self.dlon = dlon
+        self.cpu_temp = cpu_temp
+        self.done = False
+        # prossimo campione da emettere: indice nella traccia + tempo virtuale d'inizio del giro corrente
+        self.base = offset - (offset % trace.duration)
+        self.cursor = 0
+        t = trace.t
+        local = offset % trace.duration
+        while self.cursor < len(t) and t[self.cursor] < local:
+            self.cursor += 1
+        if self.cursor == len(t):
+            self.cursor = 0
+            self.base += trace.duration
+
+def make_fleet(traces, n_devices, perturb_m, speed_spread):
+    """N cloni distribuiti a rotazione sui piloti registrati."""
+    fleet = []
+    macs = set()
+    for i in range(n_devices):
+        trace = traces[i % len(traces)]
+        mac = random_mac()
+        while mac in macs:
+            mac = random_mac()
+        macs.add(mac)
+        dn = random.uniform(-perturb_m, perturb_m)
+        de = random.uniform(-perturb_m, perturb_m)
+        dlat, dlon = meters_to_latlon_offset(trace.lat0, dn, de)
+        fleet.append(VirtualDevice(
+            mac, trace,
+            offset=random.uniform(0, trace.duration),
+            scale=random.uniform(1.0 - speed_spread, 1.0 + speed_spread),
+            dlat=dlat, dlon=dlon,
+            cpu_temp=round(random.uniform(40.0, 75.0), 1),
+        ))
+    return fleet
+
+def emit_due(dev, vt_now, start_wall, net_sim):
+    """Accoda tutti i campioni della traccia con tempo virtuale <= vt_now. Restituisce quanti."""
+    tr = dev.trace
+    t = tr.t
+    n = len(t)
+    count = 0
+    while not dev.done and dev.base + t[dev.cursor] <= vt_now:
+        i = dev.cursor
+        # istante reale in cui il clone "legge" questo campione
+        wall = start_wall + (dev.base + t[i] - dev.offset) / dev.scale
+        cpu = tr.cpu[i]
+        if math.isnan(cpu):
+            cpu = dev.cpu_temp
+        timestamp_gps = ts_yyMMddHHmmss_from_time(wall)
+        ms = int((wall % 1) * 1000)
+        line = (f"{dev.mac}/{tr.lat[i] + dev.dlat:+.7f}/{tr.lon[i] + dev.dlon:+.7f}/"
+                f"{tr.sats[i]}/{tr.qual[i]}/{tr.speed[i] * dev.scale:.1f}/{timestamp_gps}/{ms}/{cpu:.1f}")
+        net_sim.enqueue_packet(dev.mac, timestamp_gps, line.encode('utf-8'))
+        count += 1
+        dev.cursor = i + 1
+        if dev.cursor == n:
+            if not tr.loop:
+                dev.done = True   # traccia aperta: niente salto dall'ultimo al primo campione
+                break
+            dev.cursor = 0
+            dev.base += tr.duration
+    return count
+
+# ---------- Main ----------
+def main():
+    ap = argparse.ArgumentParser(description="Flotta sintetica da tracce GPS registrate")
+    ap.add_argument('recording', help='Cartella della registrazione (nome in recordings/ o percorso)')
+    ap.add_argument('--devices', type=int, default=200, help='Dispositivi virtuali (default: 200)')
+    ap.add_argument('--host', default='127.0.0.1', help='Host server (default: 127.0.0.1)')
+    ap.add_argument('--port', type=int, default=8888, help='Porta UDP (default: 8888)')
+    ap.add_argument('--tick-hz', type=float, default=50.0,
+                    help='Frequenza del loop di emissione; la cadenza dei pacchetti è quella registrata (default: 50)')
+    ap.add_argument('--perturb-m', type=float, default=1.5,
+                    help='Spostamento spaziale massimo per clone in metri (default: 1.5)')
+    ap.add_argument('--speed-spread', type=float, default=0.05,
+                    help='Variazione massima del fattore di velocità, es. 0.05 = ±5%% (default: 0.05)')
+    ap.add_argument('--keep-idle', action='store_true',
+                    help='Tracce intere, senza taglio a giri e senza loop')
+    ap.add_argument('--duration', type=float, default=0, help='Durata in secondi (default: 0 = fino a Ctrl+C)')
+    ap.add_argument('--seed', type=int, default=None, help='Seed per flotte riproducibili')
+    ap.add_argument('--start-race', metavar='API', default=None,
+                    help='Avvia una gara sul backend (es. http://localhost:5000) con i MAC della flotta')
+
+    ap.add_argument('--base-delay-ms', type=int, default=50, help='Ritardo base rete ms (default: 50)')
+    ap.add_argument('--max-delay-ms', type=int, default=250, help='Ritardo massimo rete ms (default: 250)')
+    ap.add_argument('--spike-prob', type=float, default=0.04, help='Probabilità spike ritardo 0-1 (default: 0.04)')
+    ap.add_argument('--spike-delay-ms', type=int, default=1000, help='Ritardo spike ms (default: 1000)')
+    args = ap.parse_args()
+
+    if args.devices <= 0:
+        print("❌ --devices deve essere > 0", file=sys.stderr)
+        sys.exit(2)
+    if not 0 <= args.speed_spread < 1:
+        print("❌ --speed-spread deve essere in [0, 1)", file=sys.stderr)
+        sys.exit(2)
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    try:
+        folder = resolve_recording(args.recording)
+    except FileNotFoundError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        sys.exit(2)
+    t_load = time.perf_counter()
+    cfg, traces, dropped = load_recording(folder, keep_idle=args.keep_idle)
+    if not traces:
+        print(f"❌ Nessuna traccia utilizzabile in {folder}", file=sys.stderr)
+        sys.exit(2)
+    samples = sum(len(tr) for tr in traces)
+    print(f"[FLEET] Registrazione: {os.path.basename(os.path.normpath(folder))}")
+    print(f"[FLEET] Piloti: {len(traces)} | campioni: {samples} | caricata in {time.perf_counter() - t_load:.2f}s")
+    for tr in traces:
+        mode = f"{tr.laps} giri in loop" if tr.loop else "una volta, senza loop"
+        print(f"   {tr.mac}: {len(tr)} campioni, {tr.duration:.0f}s ({len(tr) / tr.duration:.1f} Hz), {mode}")
+    if dropped:
+        print(f"[FLEET] Scartati (senza un giro completo): {', '.join(dropped)}")
+
+    fleet = make_fleet(traces, args.devices, args.perturb_m, args.speed_spread)
+    print(f"[FLEET] Dispositivi virtuali: {len(fleet)} | perturbazione ±{args.perturb_m:.1f} m | "
+          f"velocità ±{args.speed_spread * 100:.0f}% | {args.host}:{args.port}")
+
+    if args.start_race:
+        from wsswarm import start_race
+        circuit_id = (cfg.get('config') or {}).get('circuitId')
+        if not circuit_id:
+            print("❌ circuitId assente in config.json: impossibile avviare la gara", file=sys.stderr)
+            sys.exit(2)
+        try:
+            start_race(args.start_race, circuit_id, [d.mac for d in fleet])
+        except (OSError, ValueError, RuntimeError) as e:
+            print(f"❌ Avvio gara fallito su {args.start_race}: {e}", file=sys.stderr)
+            sys.exit(2)
+        print(f"[FLEET] Gara avviata su {args.start_race} ({circuit_id})")
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    addr = (args.host, args.port)
+    net_sim = NetworkDelaySimulator(args.base_delay_ms, args.max_delay_ms, args.spike_prob, args.spike_delay_ms)
+
+    print(f"[FLEET] Premi Ctrl+C per terminare\n")
+    dt = 1.0 / args.tick_hz
+    start = time.perf_counter()
+    start_wall = time.time()
+    last_tick = start
+    last_stats_print = start
+    generated = 0
+
+    try:
+        while True:
+            now = time.perf_counter()
+            if now - last_tick < dt:
+                time.sleep(dt - (now - last_tick))
+                now = time.perf_counter()
+            last_tick = now
+            elapsed = now - start
+            if args.duration and elapsed >= args.duration:
+                break
+
+            active = 0
+            for dev in fleet:
+                if not dev.done:
+                    generated += emit_due(dev, dev.offset + elapsed * dev.scale, start_wall, net_sim)
+                    active += not dev.done
+            net_sim.send_ready_packets(sock, addr)
+            if not active:
+                print("[FLEET] Tutte le tracce (senza loop) sono terminate")
+                break
+
+            if now - last_stats_print >= 5.0:
+                stats = net_sim.stats
+                print(f"[STATS] Generati: {generated} ({generated / elapsed:.0f}/s) | "
+                      f"Queue: {stats['current_queue_size']}/{stats['max_queue_size']} | "
+                      f"Sent: {stats['packets_sent']} | Spikes: {stats['spikes_triggered']}")
+                last_stats_print = now
+    except KeyboardInterrupt:
+        print("\n[FLEET] Interruzione utente...")
+    finally:
+        # consegna i pacchetti ancora in coda (al massimo 5s)
+        flush_deadline = time.perf_counter() + 5.0
+        while net_sim.stats['current_queue_size'] > 0 and time.perf_counter() < flush_deadline:
+            net_sim.send_ready_packets(sock, addr)
+            time.sleep(0.01)
+        stats = net_sim.get_stats()
+        print(f"\n[FLEET] Generati: {generated} | Inviati: {stats['packets_sent']} | "
+              f"Rimasti in coda: {stats['current_queue_size']} | Coda max: {stats['max_queue_size']}")
+        sock.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+# httpload.py
+#
+# Generatore di carico REST (asyncio, connessioni keep-alive in pool) che
+# riproduce il mix di richieste delle pagine live durante una gara simulata:
+#   race_live   GET /api/race/state, GET /api/circuits/:id
+#   pilot_live  GET /api/race/pilot/:mac, GET /api/circuits/:id
+#   race_setup  GET /api/circuits, GET /api/pilots, GET /api/race/state, GET /api/circuits/:id
+#
+# La misura ha due fasi: una di riferimento senza carico HTTP e una con il
+# carico. In entrambe una sonda WebSocket (relay UDP + spettatore di wsswarm.py)
+# misura la latenza UDP→telemetry, per capire se il carico HTTP rallenta il
+# percorso live. Riporta throughput e percentili di latenza per endpoint.
+#
+# Uso (backend già avviato con `npm start`):
+#   python3 httpload.py --concurrency 50 --duration 30 --start-race <circuitId> \
+#       -- --file data/circuiti/<ID>.json --devices 20 --hz 15
+
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+from loadharness import percentile
+from wsswarm import SIMULATOR, Spectator, UDPRelay, http_json, start_race
+
+# pagina -> sequenza di richieste al caricamento ({circuit} e {mac} sostituiti a runtime)
+PAGE_MIXES = {
+    'race_live': ['/api/race/state', '/api/circuits/{circuit}'],
+    'pilot_live': ['/api/race/pilot/{mac}', '/api/circuits/{circuit}'],
+    'race_setup': ['/api/circuits', '/api/pilots', '/api/race/state', '/api/circuits/{circuit}'],
+}
+
+# attesa massima dei piloti in /api/race/state (jitter buffer del backend: 2s di default)
+MACS_POLL_S = 10.0
+
+# ---------- Client HTTP/1.1 keep-alive ----------
+class HTTPError(Exception):
+    pass
+
+class HTTPConnection:
+    """Connessione HTTP/1.1 persistente: GET con Content-Length o chunked."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def _ensure(self):
+        if self.writer is None or self.writer.is_closing():
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    async def get(self, path):
+        """Restituisce (status, lunghezza body); riapre la connessione se il server l'ha chiusa."""
+        for attempt in (0, 1):
+            await self._ensure()
+            try:
+                self.writer.write(f"GET {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n"
+                                  f"Connection: keep-alive\r\n\r\n".encode())
+                return await self._read_response()
+            except (asyncio.IncompleteReadError, ConnectionError):
+                self.close()
+                if attempt:
+                    raise HTTPError('connessione chiusa dal server')
+            except (ValueError, IndexError, asyncio.LimitOverrunError) as e:
+                # risposta letta a metà: la connessione non è più allineata, non va riusata
+                self.close()
+                raise HTTPError(f'risposta non valida: {e}')
+
+    async def _read_response(self):
+        head = (await self.reader.readuntil(b'\r\n\r\n')).decode('latin-1').split('\r\n')
+        status = int(head[0].split(' ', 2)[1])
+        headers = {}
+        for h in head[1:]:
+            if ':' in h:
+                k, v = h.split(':', 1)
+                headers[k.strip().lower()] = v.strip().lower()
+        size = 0
+        if headers.get('transfer-encoding') == 'chunked':
+            while True:
+                n = int((await self.reader.readuntil(b'\r\n')).split(b';')[0], 16)
+                await self.reader.readexactly(n + 2)
+                size += n
+                if n == 0:
+                    break
+        else:
+            size = int(headers.get('content-length', 0))
+            await self.reader.readexactly(size)
+        if headers.get('connection') == 'close':
+            self.close()
+        return status, size
+
+class ConnectionPool:
+    """
+    Pool di connessioni keep-alive condiviso dagli utenti virtuali.
+    Le connessioni rilasciate passano direttamente al primo utente in attesa
+    (FIFO): con una coda semplice chi rilascia la riprenderebbe subito, senza
+    cedere il turno, e gli altri utenti resterebbero fermi per tutto il test.
+    """
+
+    def __init__(self, host, port, size):
+        self.conns = [HTTPConnection(host, port) for _ in range(size)]
+        self.free = deque(self.conns)
+        self.waiters = deque()
+
+    async def acquire(self):
+        if self.free and not self.waiters:
+            return self.free.popleft()
+        fut = asyncio.get_running_loop().create_future()
+        self.waiters.append(fut)
+        try:
+            return await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release(fut.result())
+            raise
+
+    def release(self, conn):
+        while self.waiters:
+            fut = self.waiters.popleft()
+            if not fut.done():
+                fut.set_result(conn)
+                return
+        self.free.append(conn)
+
+    def close(self):
+        for conn in self.conns:
+            conn.close()
+
+# ---------- Utenti virtuali ----------
+class EndpointStats:
+    def __init__(self):
+        self.latency_ms = []
+        self.pool_wait_ms = []
+        self.errors = 0
+        self.status = {}
+        self.bytes = 0
+
+def endpoint_name(template):
+    return template.replace('{circuit}', ':id').replace('{mac}', ':mac')
+
+async def virtual_user(pool, mix, ctx, stats, deadline, think_ms):
+    pages = list(mix)
+    weights = [mix[p] for p in pages]
+    while time.perf_counter() < deadline:
+        page = random.choices(pages, weights)[0]
+        for template in PAGE_MIXES[page]:
+            path = template.format(circuit=ctx['circuit'], mac=random.choice(ctx['macs']) if ctx['macs'] else 'NONE')
+            st = stats.setdefault(endpoint_name(template), EndpointStats())
+            # attesa di una connessione libera (coda lato client) misurata a parte dalla latenza
+            t_wait = time.perf_counter()
+            conn = await pool.acquire()
+            t0 = time.perf_counter()
+            st.pool_wait_ms.append((t0 - t_wait) * 1000)
+            try:
+                status, size = await conn.get(path)
+            except (OSError, HTTPError, ValueError):
+                st.errors += 1
+                continue
+            finally:
+                pool.release(conn)
+            st.latency_ms.append((time.perf_counter() - t0) * 1000)
+            st.status[status] = st.status.get(status, 0) + 1
+            st.bytes += size
+        if think_ms:
+            await asyncio.sleep(random.uniform(0.5, 1.5) * think_ms / 1000.0)
+
+# ---------- Report ----------
+def _pcts(vals):
+    s = sorted(vals)
+    return {'p50': percentile(s, 50), 'p99': percentile(s, 99), 'p999': percentile(s, 99.9)}
+
+def _fmt(v):
+    return f"{v:8.1f}" if v is not None else "       -"
+
+def print_report(rep):
+    print(f"\n[HTTP] {rep['concurrency']} utenti | pool {rep['pool']} | {rep['durationS']:.0f}s | "
+          f"{rep['requests']} richieste ({rep['throughputRps']:.0f} req/s)")
+    print(f"  {'endpoint':<26} {'req':>7} {'err':>5} {'p50 ms':>8} {'p99':>8} {'p999':>8} {'pool p99':>8} {'MB':>8}")
+    for name, e in sorted(rep['endpoints'].items()):
+        l = e['latencyMs']
+        print(f"  {name:<26} {e['requests']:>7} {e['errors']:>5} {_fmt(l['p50'])} {_fmt(l['p99'])} {_fmt(l['p999'])} "
+              f"{_fmt(e['poolWaitMs']['p99'])} {e['bytes'] / 1e6:>8.1f}")
+    probe = rep.get('telemetryProbe')
+    if probe:
+        print("  Latenza UDP→telemetry (sonda WebSocket):")
+        for phase in ('baseline', 'load'):
+            p = probe[phase]
+            print(f"    {phase:<9} p50 {_fmt(p['p50'])} p99 {_fmt(p['p99'])} p999 {_fmt(p['p999'])}  ({p['samples']} campioni)")
+
+# ---------- Sonda telemetry ----------
+class TelemetryProbe:
+    """
+    Relay UDP e spettatore WebSocket su un thread con event loop dedicato:
+    la misura non risente delle code dell'event loop che genera il carico HTTP.
+    """
+
+    def __init__(self, relay_port, udp_target, ws_host, ws_port):
+        self.ws_host = ws_host
+        self.ws_port = ws_port
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        host, port = udp_target.rsplit(':', 1)
+        self.transport, self.relay = asyncio.run_coroutine_threadsafe(self.loop.create_datagram_endpoint(
+            lambda: UDPRelay((host, int(port))), local_addr=('127.0.0.1', relay_port)), self.loop).result()
+
+    async def _phase(self, seconds):
+        spec = Spectator(0)
+        await spec.run(self.ws_host, self.ws_port, self.relay, time.perf_counter() + seconds, True)
+        out = _pcts(spec.fanout_ms)
+        out['samples'] = len(spec.fanout_ms)
+        return out
+
+    async def measure(self, seconds):
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self._phase(seconds), self.loop))
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.transport.close)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+# ---------- Main ----------
+async def run_load(args, sim_args):
+    api = args.api.rstrip('/')
+    u = urlsplit(api)
+    ws = urlsplit(args.ws)
+    probe = relay = sim = None
+    started_race = False
+    assigned = []
+    pool = ConnectionPool(u.hostname, u.port or 80, args.pool)
+    try:
+        if sim_args:
+            probe = TelemetryProbe(args.relay_port, args.udp_target, ws.hostname, ws.port)
+            relay = probe.relay
+            cmd = [sys.executable, SIMULATOR] + sim_args + ['--host', '127.0.0.1', '--port', str(args.relay_port)]
+            sim = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            print(f"[HTTP] Simulatore avviato (PID {sim.pid}) via relay :{args.relay_port}")
+        if args.start_race:
+            await asyncio.sleep(args.warmup)
+            if not relay or not relay.macs:
+                raise SystemExit("❌ --start-race richiede il simulatore (argomenti dopo --)")
+            assigned = sorted(relay.macs)
+            await asyncio.to_thread(start_race, api, args.start_race, assigned)
+            started_race = True
+            print(f"[HTTP] Gara avviata su {args.start_race} con {len(relay.macs)} dispositivi")
+
+        # contesto: circuito e MAC della gara in corso. I piloti compaiono nello stato solo dopo
+        # il primo pacchetto uscito dal jitter buffer: se la gara l'abbiamo avviata noi valgono i
+        # MAC assegnati, altrimenti si interroga lo stato finché non ci sono piloti
+        state = await asyncio.to_thread(http_json, f"{api}/api/race/state")
+        macs = assigned
+        poll_deadline = time.perf_counter() + MACS_POLL_S
+        while not macs:
+            macs = [d['mac'] for d in state.get('drivers') or []]
+            if macs or 'pilot_live' not in args.mix or time.perf_counter() >= poll_deadline:
+                break
+            await asyncio.sleep(0.5)
+            state = await asyncio.to_thread(http_json, f"{api}/api/race/state")
+        if not macs and 'pilot_live' in args.mix:
+            print("[HTTP] ⚠️  Nessun pilota in gara: le richieste pilot_live otterranno 404")
+        ctx = {
+            'circuit': args.circuit or (state.get('circuit') or {}).get('id') or 'NONE',
+            'macs': macs,
+        }
+        print(f"[HTTP] Circuito {ctx['circuit']} | piloti in gara: {len(ctx['macs'])}")
+
+        probe_report = None
+        if probe and args.baseline > 0:
+            print(f"[HTTP] Fase di riferimento ({args.baseline:.0f}s, senza carico HTTP)...")
+            probe_report = {'baseline': await probe.measure(args.baseline)}
+
+        print(f"[HTTP] Carico: {args.concurrency} utenti virtuali per {args.duration:.0f}s...")
+        stats = {}
+        deadline = time.perf_counter() + args.duration
+        users = [virtual_user(pool, args.mix, ctx, stats, deadline, args.think_ms) for _ in range(args.concurrency)]
+        if probe_report is not None:
+            users.append(probe.measure(args.duration))
+        t0 = time.perf_counter()
+        results = await asyncio.gather(*users)
+        elapsed = time.perf_counter() - t0
+        if probe_report is not None:
+            probe_report['load'] = results[-1]
+
+        total = sum(len(e.latency_ms) for e in stats.values())
+        return {
+            'concurrency': args.concurrency,
+            'pool': args.pool,
+            'durationS': elapsed,
+            'mix': args.mix,
+            'requests': total,
+            'throughputRps': total / elapsed if elapsed > 0 else 0.0,
+            'endpoints': {name: {
+                'requests': len(e.latency_ms),
+                'errors': e.errors,
+                'status': e.status,
+                'bytes': e.bytes,
+                'latencyMs': _pcts(e.latency_ms),
+                'poolWaitMs': _pcts(e.pool_wait_ms),
+            } for name, e in stats.items()},
+            'telemetryProbe': probe_report,
+        }
+    finally:
+        pool.close()
+        if started_race:
+            try:
+                await asyncio.to_thread(http_json, f"{api}/api/race/stop", {})
+            except OSError as e:
+                print(f"[HTTP] Errore stop gara: {e}")
+        if sim and sim.poll() is None:
+            sim.terminate()
+            sim.wait()
+        if probe:
+            probe.close()
+
+def parse_mix(txt):
+    mix = {}
+    for part in txt.split(','):
+        name, _, w = part.partition('=')
+        name = name.strip()
+        if name not in PAGE_MIXES:
+            raise argparse.ArgumentTypeError(f"pagina sconosciuta: {name} (disponibili: {', '.join(PAGE_MIXES)})")
+        mix[name] = float(w or 1)
+    return mix
+
+def main():
+    ap = argparse.ArgumentParser(
+        description="Generatore di carico REST con mix di richieste per pagina",
+        epilog="Gli argomenti dopo -- avviano tracksimulator.py verso il relay (es. -- --file <tracciato> --devices 20)"
+    )
+    ap.add_argument('--api', default='http://127.0.0.1:5000', help='URL API REST (default: http://127.0.0.1:5000)')
+    ap.add_argument('--ws', default='ws://127.0.0.1:5001', help='URL WebSocket per la sonda (default: ws://127.0.0.1:5001)')
+    ap.add_argument('--concurrency', type=int, default=20, help='Utenti virtuali concorrenti (default: 20)')
+    ap.add_argument('--pool', type=int, default=10, help='Connessioni keep-alive nel pool (default: 10)')
+    ap.add_argument('--duration', type=float, default=30.0, help='Durata fase di carico in secondi (default: 30)')
+    ap.add_argument('--baseline', type=float, default=10.0,
+                    help='Durata fase di riferimento senza carico, 0 per saltarla (default: 10)')
+    ap.add_argument('--think-ms', type=float, default=0.0,
+                    help='Pausa media fra due caricamenti di pagina per utente (default: 0, burst)')
+    ap.add_argument('--mix', type=parse_mix, default=parse_mix('race_live=0.6,pilot_live=0.3,race_setup=0.1'),
+                    help='Pesi delle pagine (default: race_live=0.6,pilot_live=0.3,race_setup=0.1)')
+    ap.add_argument('--circuit', default=None, help='Id circuito per /api/circuits/:id (default: quello della gara)')
+    ap.add_argument('--relay-port', type=int, default=8887, help='Porta del relay UDP (default: 8887)')
+    ap.add_argument('--udp-target', default='127.0.0.1:8888', help='Porta UDP del backend (default: 127.0.0.1:8888)')
+    ap.add_argument('--start-race', metavar='CIRCUIT_ID', default=None,
+                    help='Avvia (e poi ferma) una gara assegnando ai piloti i MAC del simulatore')
+    ap.add_argument('--warmup', type=float, default=3.0,
+                    help='Secondi di traffico prima di avviare la gara (default: 3)')
+    ap.add_argument('--json', default=None, help='Salva il report completo in JSON')
+    ap.add_argument('sim_args', nargs=argparse.REMAINDER)
+    args = ap.parse_args()
+
+    sim_args = args.sim_args[1:] if args.sim_args[:1] == ['--'] else args.sim_args
+    if args.concurrency <= 0 or args.pool <= 0 or args.duration <= 0:
+        print("❌ concurrency, pool e duration devono essere > 0", file=sys.stderr)
+        sys.exit(2)
+
+    try:
+        rep = asyncio.run(run_load(args, sim_args))
+    except KeyboardInterrupt:
+        print("\n[HTTP] Interrotto.")
+        return
+    print_report(rep)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(rep, f, indent=2)
+        print(f"\n[HTTP] Report salvato in {args.json}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+# loadharness.py
+#
+# Harness di carico end-to-end: avvia tracksimulator.py affiancato da un
+# ricevitore UDP Python che replica il parsing di server.js
+# (udpServer.on('message')) e il suo jitter buffer (JITTER_DELAY_MS, ancore
+# per-MAC, flush ogni JITTER_FLUSH_INTERVAL_MS, cap JITTER_MAX_QUEUE).
+#
+# Per ogni punto della griglia dispositivi×Hz misura, grazie alla sequenza e
+# al timestamp di invio inseriti dal simulatore (--embed-seq):
+# - latenza di rete (ricezione UDP - invio) e di consegna (uscita dal jitter buffer - invio)
+#   con percentili p50/p99/p999
+# - perdita (sequenze mancanti per MAC)
+# - pacchetti fuori ordine all'arrivo e all'uscita dal jitter buffer
+#
+# Tutto gira su localhost, senza servizi esterni.
+#
+# Uso:
+#   python3 loadharness.py --file data/circuiti/<ID>.json --grid-devices 10,100,500 --grid-hz 5,15 --duration 20
+
+import argparse
+import calendar
+import json
+import math
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+# Stessi default di server.js
+JITTER_DELAY_MS = int(os.environ.get('JITTER_DELAY_MS', '2000'))
+JITTER_FLUSH_INTERVAL_MS = int(os.environ.get('JITTER_FLUSH_INTERVAL_MS', '10'))
+JITTER_MAX_QUEUE = int(os.environ.get('JITTER_MAX_QUEUE', '100000'))
+
+SIMULATOR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tracksimulator.py')
+
+# ---------- Parsing (come server.js) ----------
+_ts_cache = {}
+
+def parse_ts_to_epoch_ms(ts_yy, fallback_ms):
+    """Converte YYMMDDhhmmss (UTC) in epoch ms, fallback se non valido (parseTsToEpochMs)."""
+    if not ts_yy or len(ts_yy) != 12:
+        return fallback_ms
+    ms = _ts_cache.get(ts_yy)
+    if ms is None:
+        try:
+            ms = calendar.timegm((2000 + int(ts_yy[0:2]), int(ts_yy[2:4]), int(ts_yy[4:6]),
+                                  int(ts_yy[6:8]), int(ts_yy[8:10]), int(ts_yy[10:12]), 0, 0, 0)) * 1000
+        except ValueError:
+            return fallback_ms
+        if len(_ts_cache) > 4096:
+            _ts_cache.clear()
+        _ts_cache[ts_yy] = ms
+    return ms
+
+def parse_packet(msg, now_ms):
+    """
+    Replica udpServer.on('message'): restituisce il dict gps o None se il pacchetto
+    viene scartato. Aggiunge 'seq' e 'sentAt' se il simulatore li ha inseriti.
+    """
+    parts = msg.decode('utf-8', 'replace').strip().split('/')
+    if len(parts) < 7:
+        return None
+    gps = {
+        'mac': parts[0].upper(),
+        'ts': parts[6] or None,
+        'receivedAt': now_ms,
+    }
+    try:
+        gps['lat'] = float(parts[1])
+        gps['lon'] = float(parts[2])
+    except ValueError:
+        gps['lat'] = gps['lon'] = float('nan')
+    if len(parts) >= 8 and parts[7].isdigit() and len(parts[7]) <= 3:
+        gps['tms'] = int(parts[7])
+    # Campi del load harness (--embed-seq): .../ms/cpuTemp/seq/sentAt
+    if len(parts) == 11:
+        try:
+            gps['seq'] = int(parts[9])
+            gps['sentAt'] = int(parts[10])
+        except ValueError:
+            pass
+    return gps
+
+# ---------- Jitter buffer (come server.js) ----------
+class JitterBufferModel:
+    """Modello di _enqueueJitter/_flushJitter: ancore per-MAC e ritardo fisso."""
+
+    def __init__(self, delay_ms=JITTER_DELAY_MS, max_queue=JITTER_MAX_QUEUE):
+        self.delay_ms = delay_ms
+        self.max_queue = max_queue
+        # mac -> (anchorDevMs, anchorSrvMs)
+        self.anchors = {}
+        # mac -> [(emitAt, devMs, gps)]
+        self.queues = {}
+        self.total_queued = 0
+        self.dropped = 0
+
+    def enqueue(self, gps, now_ms):
+        base_ts = parse_ts_to_epoch_ms(gps['ts'], gps['receivedAt'])
+        tms = max(0, min(999, gps.get('tms', 0)))
+        dev_ms = base_ts + tms
+
+        a = self.anchors.get(gps['mac'])
+        if a is None:
+            a = self.anchors[gps['mac']] = (dev_ms, now_ms)
+        emit_at = a[1] + (dev_ms - a[0]) + self.delay_ms
+
+        arr = self.queues.setdefault(gps['mac'], [])
+        arr.append((emit_at, dev_ms, gps))
+        self.total_queued += 1
+
+        # Cap assoluto (drop più recente se superiamo)
+        if self.total_queued > self.max_queue:
+            arr.pop()
+            self.total_queued -= 1
+            self.dropped += 1
+
+    def flush(self, now_ms):
+        """Restituisce i pacchetti maturi, in ordine di devMs per ciascun MAC."""
+        out = []
+        for mac in list(self.queues):
+            arr = self.queues[mac]
+            due = [it for it in arr if it[0] <= now_ms]
+            if not due:
+                continue
+            keep = [it for it in arr if it[0] > now_ms]
+            # sort stabile come Array.prototype.sort
+            due.sort(key=lambda it: it[1])
+            out.extend(it[2] for it in due)
+            self.total_queued -= len(due)
+            if keep:
+                self.queues[mac] = keep
+            else:
+                del self.queues[mac]
+        return out
+
+# ---------- Statistiche ----------
+def percentile(sorted_vals, p):
+    """Percentile nearest-rank su lista già ordinata."""
+    if not sorted_vals:
+        return None
+    k = max(0, min(len(sorted_vals) - 1, math.ceil(p / 100.0 * len(sorted_vals)) - 1))
+    return sorted_vals[k]
+
+class DeliveryStats:
+    """Accumula latenze, perdite e riordini per un punto della griglia."""
+
+    def __init__(self):
+        self.received = 0
+        self.rejected = 0
+        self.untagged = 0
+        self.duplicates = 0
+        self.ooo_arrival = 0
+        self.ooo_emit = 0
+        self.emitted = 0
+        self.net_latency = []
+        self.delivery_latency = []
+        # mac -> {max_seq, seen, last_arrival_seq, last_emit_seq}
+        self.per_mac = {}
+
+    def on_arrival(self, gps, now_ms):
+        self.received += 1
+        seq = gps.get('seq')
+        if seq is None:
+            self.untagged += 1
+            return
+        m = self.per_mac.setdefault(gps['mac'], {'max_seq': -1, 'seen': set(), 'last_arrival': -1, 'last_emit': -1})
+        if seq in m['seen']:
+            self.duplicates += 1
+        m['seen'].add(seq)
+        if seq < m['last_arrival']:
+            self.ooo_arrival += 1
+        m['last_arrival'] = max(m['last_arrival'], seq)
+        m['max_seq'] = max(m['max_seq'], seq)
+        self.net_latency.append(now_ms - gps['sentAt'])
+
+    def on_emit(self, gps, now_ms):
+        self.emitted += 1
+        seq = gps.get('seq')
+        if seq is None:
+            return
+        m = self.per_mac[gps['mac']]
+        if seq < m['last_emit']:
+            self.ooo_emit += 1
+        m['last_emit'] = max(m['last_emit'], seq)
+        self.delivery_latency.append(now_ms - gps['sentAt'])
+
+    def report(self):
+        # Le sequenze partono da 0 per ogni device: attesi = max_seq + 1
+        expected = sum(m['max_seq'] + 1 for m in self.per_mac.values())
+        unique = sum(len(m['seen']) for m in self.per_mac.values())
+        net = sorted(self.net_latency)
+        dlv = sorted(self.delivery_latency)
+        tagged = max(1, self.received - self.untagged)
+        return {
+            'macs': len(self.per_mac),
+            'received': self.received,
+            'emitted': self.emitted,
+            'expected': expected,
+            'lost': expected - unique,
+            'loss_rate': (expected - unique) / expected if expected else 0.0,
+            'duplicates': self.duplicates,
+            'ooo_arrival_rate': self.ooo_arrival / tagged,
+            'ooo_emit_rate': self.ooo_emit / max(1, self.emitted),
+            'net_latency_ms': {p: percentile(net, q) for p, q in (('p50', 50), ('p99', 99), ('p999', 99.9))},
+            'delivery_latency_ms': {p: percentile(dlv, q) for p, q in (('p50', 50), ('p99', 99), ('p999', 99.9))},
+        }
+
+# ---------- Harness ----------
+def run_receiver(sock, jitter, stats, until):
+    """Riceve e processa pacchetti fino a `until` (perf_counter), con flush periodico del jitter buffer."""
+    flush_every = JITTER_FLUSH_INTERVAL_MS / 1000.0
+    next_flush = time.perf_counter() + flush_every
+    sock.settimeout(flush_every)
+    while True:
+        now = time.perf_counter()
+        if now >= until:
+            return
+        if now >= next_flush:
+            now_ms = int(time.time() * 1000)
+            for gps in jitter.flush(now_ms):
+                stats.on_emit(gps, now_ms)
+            next_flush = now + flush_every
+        try:
+            msg, _ = sock.recvfrom(2048)
+        except socket.timeout:
+            continue
+        now_ms = int(time.time() * 1000)
+        gps = parse_packet(msg, now_ms)
+        if gps is None:
+            stats.rejected += 1
+            continue
+        stats.on_arrival(gps, now_ms)
+        jitter.enqueue(gps, now_ms)
+
+def run_grid_point(track_file, devices, hz, duration, port, sim_args, verbose=False):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    # buffer di ricezione ampio: a migliaia di pkt/s il default del kernel perde pacchetti
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 * 1024 * 1024)
+    sock.bind(('127.0.0.1', port))
+
+    cmd = [sys.executable, SIMULATOR, '--file', track_file, '--devices', str(devices),
+           '--hz', str(hz), '--host', '127.0.0.1', '--port', str(port), '--embed-seq'] + sim_args
+    out = None if verbose else subprocess.DEVNULL
+    proc = subprocess.Popen(cmd, stdout=out, stderr=out)
+
+    jitter = JitterBufferModel()
+    stats = DeliveryStats()
+    try:
+        run_receiver(sock, jitter, stats, time.perf_counter() + duration)
+        # Ctrl+C al simulatore: flush finale delle sue code
+        proc.send_signal(signal.SIGINT)
+        drain_until = time.perf_counter() + 6.0
+        while proc.poll() is None and time.perf_counter() < drain_until:
+            run_receiver(sock, jitter, stats, time.perf_counter() + 0.1)
+        # attende l'uscita dal jitter buffer degli ultimi pacchetti
+        run_receiver(sock, jitter, stats, time.perf_counter() + JITTER_DELAY_MS / 1000.0 + 0.2)
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+        sock.close()
+
+    rep = stats.report()
+    rep.update({'devices': devices, 'hz': hz, 'duration_s': duration,
+                'jitter_dropped': jitter.dropped, 'jitter_left': jitter.total_queued,
+                'rejected': stats.rejected})
+    return rep
+
+def _fmt_ms(v):
+    return f"{v:>6d}" if v is not None else "     -"
+
+def print_report(rows):
+    print()
+    print(f"{'dev':>5} {'Hz':>5} | {'rete p50':>8} {'p99':>6} {'p999':>6} | {'cons p50':>8} {'p99':>6} {'p999':>6} | "
+          f"{'perdita':>7} {'ooo arr':>7} {'ooo out':>7}")
+    for r in rows:
+        n, d = r['net_latency_ms'], r['delivery_latency_ms']
+        print(f"{r['devices']:>5} {r['hz']:>5.1f} | {_fmt_ms(n['p50']):>8} {_fmt_ms(n['p99'])} {_fmt_ms(n['p999'])} | "
+              f"{_fmt_ms(d['p50']):>8} {_fmt_ms(d['p99'])} {_fmt_ms(d['p999'])} | "
+              f"{r['loss_rate']*100:>6.2f}% {r['ooo_arrival_rate']*100:>6.2f}% {r['ooo_emit_rate']*100:>6.2f}%")
+
+def _int_list(txt):
+    return [int(x) for x in txt.split(',') if x.strip()]
+
+def _float_list(txt):
+    return [float(x) for x in txt.split(',') if x.strip()]
+
+def main():
+    ap = argparse.ArgumentParser(
+        description="Load harness end-to-end: simulatore + ricevitore con jitter buffer modellato su server.js",
+        epilog="Gli argomenti dopo -- vengono passati a tracksimulator.py (es. -- --max-delay-ms 1500)"
+    )
+    ap.add_argument('--file', required=True, help='File JSON del tracciato')
+    ap.add_argument('--grid-devices', type=_int_list, default=[10, 100],
+                    help='Numero dispositivi, separati da virgola (default: 10,100)')
+    ap.add_argument('--grid-hz', type=_float_list, default=[15.0],
+                    help='Frequenze Hz, separate da virgola (default: 15)')
+    ap.add_argument('--duration', type=float, default=20.0,
+                    help='Durata di ogni punto della griglia in secondi (default: 20)')
+    ap.add_argument('--port', type=int, default=18888,
+                    help='Porta UDP locale del ricevitore (default: 18888)')
+    ap.add_argument('--json', default=None, help='Salva il report completo in JSON')
+    ap.add_argument('--verbose', action='store_true', help='Mostra l\'output del simulatore')
+    ap.add_argument('sim_args', nargs=argparse.REMAINDER)
+    args = ap.parse_args()
+
+    sim_args = args.sim_args[1:] if args.sim_args[:1] == ['--'] else args.sim_args
+    if args.duration <= 0 or not args.grid_devices or not args.grid_hz:
+        print("❌ Griglia o durata non valide", file=sys.stderr)
+        sys.exit(2)
+
+    print(f"[HARNESS] Jitter buffer: delay={JITTER_DELAY_MS}ms flush={JITTER_FLUSH_INTERVAL_MS}ms cap={JITTER_MAX_QUEUE}")
+    rows = []
+    for devices in args.grid_devices:
+        for hz in args.grid_hz:
+            print(f"[HARNESS] {devices} dispositivi @ {hz:.1f} Hz per {args.duration:.0f}s...")
+            rows.append(run_grid_point(args.file, devices, hz, args.duration, args.port, sim_args, args.verbose))
+    print_report(rows)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(rows, f, indent=2)
+        print(f"\n[HARNESS] Report salvato in {args.json}")
+
+if __name__ == '__main__':
+    main()
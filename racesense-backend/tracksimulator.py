@@ -18,16 +18,29 @@
 # - Simula ritardi di rete casuali (0-800ms) con spike occasionali (fino a 2s)
 
 import argparse
+import bisect
+import gc
 import json
+import os
 import math
 import random
 import socket
 import string
+import struct
 import sys
 import time
 import heapq
+import inspect
+import itertools
+import queue
+import re
+import signal
+import threading
+import tracemalloc
 from datetime import datetime, timezone
 from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import resource_tracker, shared_memory
 
 # ---------- Geodesia ----------
 R_EARTH = 6371000.0  # m
@@ -76,15 +89,15 @@ class SimplexNoiseGenerator:
     
     def __init__(self, seed=None):
         self.seed = seed if seed is not None else random.randint(0, 1000000)
-        random.seed(self.seed)
         self.grid_size = 100.0
         self.values = {}
     
     def _get_grid_value(self, grid_x):
         """Ottiene o genera un valore random per un punto griglia."""
         if grid_x not in self.values:
-            random.seed(self.seed + grid_x * 12345)
-            self.values[grid_x] = random.uniform(-1, 1)
+            # generatore dedicato: riseminare il random globale renderebbe deterministici
+            # (e ciclici) i MAC e le velocità dei dispositivi creati dopo
+            self.values[grid_x] = random.Random(self.seed + grid_x * 12345).uniform(-1, 1)
         return self.values[grid_x]
     
     def _smoothstep(self, t):
@@ -225,27 +238,48 @@ class NetworkDelaySimulator:
         heapq.heappush(q, (send_time, timestamp_gps, payload))
         self.stats['packets_queued'] += 1
 
-        # update queue stats
-        total = sum(len(qq) for qq in self.queues.values())
-        self.stats['current_queue_size'] = total
-        self.stats['max_queue_size'] = max(self.stats['max_queue_size'], total)
+        # update queue stats (contatore incrementale: con migliaia di device
+        # una somma su tutte le code per ogni pacchetto diventa O(n²) per tick)
+        self.stats['current_queue_size'] += 1
+        total = self.stats['current_queue_size']
+        if total > self.stats['max_queue_size']:
+            self.stats['max_queue_size'] = total
 
         self._last_tick = now
 
+    def force_blackout(self, mac, duration_ms):
+        """Forza un blackout per il MAC indicato (comando di controllo runtime)."""
+        now = time.perf_counter()
+        st = self.state.setdefault(mac, {'blackout_until': 0.0, 'in_blackout': False, 'next_flush_time': 0.0})
+        st['blackout_until'] = max(st['blackout_until'], now + duration_ms / 1000.0)
+        if not st['in_blackout']:
+            st['in_blackout'] = True
+            self.stats['blackouts_started'] += 1
+
+    def forget_device(self, mac):
+        """Rimuove lo stato di un dispositivo spento; i pacchetti già in coda vengono comunque consegnati."""
+        self.state.pop(mac, None)
+
     def send_ready_packets(self, sock, addr):
         now = time.perf_counter()
         sent = 0
+        empty = []
         for mac, q in self.queues.items():
             # invia tutti i pacchetti maturi per questo MAC
             while q and q[0][0] <= now:
                 _, _, payload = heapq.heappop(q)
+                self.stats['current_queue_size'] -= 1
                 try:
                     sock.sendto(payload, addr)
                     sent += 1
                     self.stats['packets_sent'] += 1
                 except Exception as e:
                     print(f"[NET] Errore invio pacchetto: {e}")
-        self.stats['current_queue_size'] = sum(len(qq) for qq in self.queues.values())
+            if not q and mac not in self.state:
+                empty.append(mac)
+        # code svuotate di dispositivi rimossi
+        for mac in empty:
+            del self.queues[mac]
         return sent
 
     def get_stats(self):
@@ -323,6 +357,89 @@ def interpolate_on_path(points, cumdist, s):
     lat, lon = slerp_latlon(points[i-1][0], points[i-1][1], points[i][0], points[i][1], t)
     return lat, lon
 
+# ---------- Proiezione locale ENU ----------
+class TrackENU:
+    """
+    Tracciato proiettato su un piano tangente locale (East/North, metri) calcolato
+    una sola volta al caricamento. Interpolazione e offset diventano aritmetica
+    lineare: niente slerp né cos() per pacchetto.
+
+    Errore rispetto a interpolate_on_path + meters_to_latlon_offset (sferico):
+    i vertici del tracciato sono riprodotti esattamente (andata/ritorno con la
+    stessa scala); restano l'interpolazione lineare su segmenti di pochi metri
+    e la scala est-ovest dell'offset valutata all'origine invece che alla
+    latitudine del punto, che pesa circa offset * tan(lat) * Δlat. Per circuiti
+    entro 5 km e offset di 5 m l'errore resta sotto 1 mm, ben sotto la
+    risoluzione del pacchetto (7 decimali ≈ 1 cm). Misurato con --check-enu
+    sui tracciati in data/circuiti: massimo 0.54 mm (Rubiera, 4.6 km).
+    """
+    
+    def __init__(self, points, cumdist):
+        lats = [p[0] for p in points]
+        lons = [p[1] for p in points]
+        # origine al centro del bounding box: minimizza la distanza massima dall'origine
+        self.lat0 = (min(lats) + max(lats)) / 2.0
+        self.lon0 = (min(lons) + max(lons)) / 2.0
+        # metri -> gradi
+        self.k_lat = 180.0 / (math.pi * R_EARTH)
+        self.k_lon = 180.0 / (math.pi * R_EARTH * math.cos(to_rad(self.lat0)))
+        
+        self.cum = cumdist
+        self.total_len = cumdist[-1]
+        xs = [(lon - self.lon0) / self.k_lon for lon in lons]
+        ys = [(lat - self.lat0) / self.k_lat for lat in lats]
+        # per segmento i (fra i-1 e i): punto iniziale e pendenze dx/ds, dy/ds
+        self.seg = [None]
+        for i in range(1, len(points)):
+            ds = cumdist[i] - cumdist[i-1]
+            if ds > 0:
+                kx = (xs[i] - xs[i-1]) / ds
+                ky = (ys[i] - ys[i-1]) / ds
+            else:
+                kx = ky = 0.0
+            self.seg.append((cumdist[i-1], xs[i-1], ys[i-1], kx, ky))
+    
+    def locate_many(self, s_values, north_m, east_m, lateral_m=None):
+        """
+        Posizioni lat/lon per tutti i dispositivi: distanze s e offset nord/est in metri.
+        lateral_m (opzionale): spostamento perpendicolare al tracciato, positivo a sinistra.
+        """
+        cum, seg = self.cum, self.seg
+        last = len(cum) - 1
+        lat0, lon0, k_lat, k_lon = self.lat0, self.lon0, self.k_lat, self.k_lon
+        right = bisect.bisect_right
+        if lateral_m is None:
+            lateral_m = itertools.repeat(0.0)
+        out = []
+        for s, n, e, w in zip(s_values, north_m, east_m, lateral_m):
+            i = right(cum, s)
+            if i < 1:
+                i = 1
+            elif i > last:
+                i = last
+            s0, x0, y0, kx, ky = seg[i]
+            t = s - s0
+            # (kx, ky) è la direzione unitaria del segmento: la normale sinistra è (-ky, kx)
+            out.append((lat0 + (y0 + ky * t + n + kx * w) * k_lat, lon0 + (x0 + kx * t + e - ky * w) * k_lon))
+        return out
+
+def enu_max_error_m(points, cumdist, step_m=0.5, offset_m=5.0):
+    """Confronta TrackENU con il calcolo sferico lungo tutto il tracciato: (errore max, medio) in metri."""
+    enu = TrackENU(points, cumdist)
+    n = int(cumdist[-1] / step_m)
+    s_values = [k * step_m for k in range(n)]
+    offs = [offset_m * math.sin(k * 0.1) for k in range(n)]
+    offe = [offset_m * math.cos(k * 0.1) for k in range(n)]
+    approx = enu.locate_many(s_values, offs, offe)
+    worst = total = 0.0
+    for s, on, oe, (lat, lon) in zip(s_values, offs, offe, approx):
+        blat, blon = interpolate_on_path(points, cumdist, s)
+        dlat, dlon = meters_to_latlon_offset(blat, on, oe)
+        err = haversine_m(blat + dlat, blon + dlon, lat, lon)
+        worst = max(worst, err)
+        total += err
+    return worst, total / max(1, n)
+
 # ---------- Simulatore ----------
 class Device:
     def __init__(self, mac, speed_kmh, start_s, sats, qual, trajectory_gen, cpu_temp=None):
@@ -333,16 +450,782 @@ class Device:
         self.s = start_s
         self.cpu_temp = cpu_temp
         self.trajectory_gen = trajectory_gen
+        self.seq = 0
+        self.lap = 0
+        # stato del modello di traffico (usato solo con --traffic)
+        self.v_mps = self.speed_mps
+        self.line = random.uniform(-1.0, 1.0)   # traiettoria laterale preferita (m)
+        self.lateral = self.line
+        self.lateral_target = self.line
+        self.passing = None                     # vettura che sta sorpassando
     
     @property
     def speed_mps(self):
         return self.speed_kmh * 1000.0 / 3600.0
 
+BASE_QUALS = [4, 5, 6, 7, 8, 9]
+
+def make_device(total_len, min_kmh, max_kmh, max_offset, offset_frequency, taken=None):
+    """Crea un dispositivo con MAC, velocità, posizione e traiettoria casuali (MAC non in taken)."""
+    mac = random_mac()
+    while taken is not None and mac in taken:
+        mac = random_mac()
+    speed = random.uniform(min_kmh, max_kmh)
+    start_s = random.uniform(0, total_len)
+    sats = random.randint(10, 20)
+    qual = random.choice(BASE_QUALS)
+    cpu_temp = round(random.uniform(40.0, 75.0), 1)
+    
+    seed = random.randint(0, 1000000)
+    trajectory_gen = TrajectoryGenerator(seed, max_offset, offset_frequency)
+    
+    return Device(mac, speed, start_s, sats, qual, trajectory_gen, cpu_temp)
+
+# ---------- Traffico ----------
+class TrafficModel:
+    """
+    Interazione fra dispositivi: ognuno reagisce alla vettura davanti nella sua
+    corsia (distanza di sicurezza, scia), tenta il sorpasso spostandosi di lato
+    e rientra sulla sua traiettoria quando c'è spazio.
+
+    L'indice dei vicini è la lista dei dispositivi ordinata per s, mantenuta fra
+    un tick e l'altro: da un tick al successivo cambia solo per sorpassi e
+    passaggi sul traguardo, quindi list.sort (Timsort, riconosce le sequenze già
+    ordinate) la riordina in tempo quasi lineare, O(n log n) nel caso peggiore.
+    Ogni dispositivo guarda solo i LOOKAHEAD_CARS successivi nell'ordine: il
+    costo per tick resta O(n) anche con migliaia di vetture.
+    """
+    
+    LOOKAHEAD_CARS = 4       # vetture davanti esaminate nell'indice
+    LOOKAHEAD_M = 40.0       # oltre questa distanza la vettura davanti è ignorata
+    MIN_GAP_M = 3.0          # distanza minima fra i musi (lunghezza kart + margine)
+    HEADWAY_S = 0.6          # distanza di sicurezza in secondi
+    CAR_WIDTH_M = 1.6        # sotto questa distanza laterale due vetture sono nella stessa corsia
+    PASS_SHIFT_M = 2.0       # spostamento laterale per il sorpasso
+    MAX_LATERAL_M = 3.5      # semicarreggiata utilizzabile
+    LATERAL_RATE_MPS = 1.5   # velocità di spostamento laterale
+    ACCEL_MPS2 = 4.0
+    BRAKE_MPS2 = 8.0
+    OVERTAKE_PROB_PER_S = 0.8
+    GPS_WOBBLE_M = 0.3       # oscillazione laterale massima dei pacchetti, entro la corsia
+    
+    def __init__(self, total_len, loop=True):
+        self.total_len = total_len
+        self.loop = loop
+        self.order = []
+        self.overtakes = 0
+        self.attempts = 0
+        self.following = 0
+    
+    def invalidate(self):
+        """Da chiamare quando la lista dei dispositivi cambia (aggiunte/rimozioni)."""
+        for d in self.order:
+            d.passing = None
+        self.order = []
+    
+    def _lane_clear(self, order, idx, lateral):
+        """Nessuna vettura vicina (davanti o dietro) occupa la corsia indicata."""
+        n = len(order)
+        L = self.total_len
+        me = order[idx]
+        for k in (-2, -1, 1, 2):
+            if n <= abs(k):
+                continue
+            o = order[(idx + k) % n]
+            gap = abs(o.s - me.s)
+            gap = min(gap, L - gap)
+            if gap < 2 * self.MIN_GAP_M and abs(o.lateral - lateral) < self.CAR_WIDTH_M:
+                return False
+        return True
+    
+    def step(self, devices, elapsed, jitter_speed):
+        """Aggiorna velocità, posizione s, giro e offset laterale di tutti i dispositivi."""
+        order = self.order
+        if len(order) != len(devices):
+            order = self.order = list(devices)
+        order.sort(key=lambda d: d.s)
+        
+        n = len(order)
+        L = self.total_len
+        following = 0
+        # dalla vettura più avanti: chi segue vede già la posizione aggiornata di chi precede
+        for idx in range(n - 1, -1, -1):
+            d = order[idx]
+            desired = max(0.0, d.speed_kmh + random.uniform(-jitter_speed, jitter_speed)) / 3.6
+            
+            blocker = None
+            gap = 0.0
+            for k in range(1, min(self.LOOKAHEAD_CARS, n - 1) + 1):
+                a = order[(idx + k) % n]
+                g = a.s - d.s
+                if g < 0:
+                    if not self.loop:
+                        break
+                    g += L
+                if g > self.LOOKAHEAD_M:
+                    break
+                if abs(a.lateral - d.lateral) < self.CAR_WIDTH_M:
+                    blocker, gap = a, g
+                    break
+            
+            target_v = desired
+            if blocker is not None:
+                safe = self.MIN_GAP_M + self.HEADWAY_S * d.v_mps
+                follow_v = blocker.v_mps + (gap - safe) / self.HEADWAY_S
+                if follow_v < desired:
+                    target_v = max(0.0, follow_v)
+                    following += 1
+                    # più veloce di chi sta davanti: prova il sorpasso da un lato libero
+                    if (desired > blocker.v_mps + 0.5 and d.lateral_target == d.lateral
+                            and random.random() < self.OVERTAKE_PROB_PER_S * elapsed):
+                        sides = [blocker.lateral + self.PASS_SHIFT_M, blocker.lateral - self.PASS_SHIFT_M]
+                        random.shuffle(sides)
+                        for lat in sides:
+                            if abs(lat) <= self.MAX_LATERAL_M and self._lane_clear(order, idx, lat):
+                                d.lateral_target = lat
+                                d.passing = blocker
+                                self.attempts += 1
+                                break
+            elif d.passing is None and d.lateral_target != d.line and d.lateral == d.lateral_target:
+                # sorpasso completato e strada libera: rientro sulla traiettoria preferita
+                if self._lane_clear(order, idx, d.line):
+                    d.lateral_target = d.line
+            
+            dv = target_v - d.v_mps
+            dv = max(-self.BRAKE_MPS2 * elapsed, min(self.ACCEL_MPS2 * elapsed, dv))
+            d.v_mps += dv
+            
+            dl = d.lateral_target - d.lateral
+            max_dl = self.LATERAL_RATE_MPS * elapsed
+            d.lateral = d.lateral_target if abs(dl) <= max_dl else d.lateral + math.copysign(max_dl, dl)
+            
+            advance = d.v_mps * elapsed
+            if blocker is not None:
+                # mai attraverso la vettura davanti
+                advance = min(advance, max(0.0, gap - self.MIN_GAP_M))
+            d.s += advance
+            if d.s >= L:
+                if self.loop:
+                    d.s %= L
+                    d.lap += 1
+                else:
+                    d.s = L - 1e-6
+            
+            if d.passing is not None:
+                # sorpasso contato solo su chi era davanti nella stessa corsia all'inizio del tentativo
+                gap = (d.passing.s - d.s) % L
+                if gap > L / 2:
+                    if L - gap < self.LOOKAHEAD_M:
+                        self.overtakes += 1
+                    d.passing = None
+                elif gap > self.LOOKAHEAD_M:
+                    d.passing = None   # rimasto indietro: tentativo abbandonato
+        self.following = following
+    
+    def lateral_offsets(self, devices):
+        """
+        Offset laterale da inviare: corsia del modello più un'oscillazione GPS
+        contenuta entro la corsia (il rumore nord/est della traiettoria, ampio
+        diversi metri, farebbe apparire sorpassi e sovrapposizioni inesistenti).
+        """
+        w = self.GPS_WOBBLE_M
+        lim = self.MAX_LATERAL_M
+        return [max(-lim, min(lim, d.lateral + d.trajectory_gen.noise_lat.noise(d.s / d.trajectory_gen.frequency) * w))
+                for d in devices]
+
+# ---------- Controllo runtime ----------
+# Canale di controllo HTTP su localhost. I comandi vengono accodati dal thread
+# del server e applicati dal loop di simulazione all'inizio del tick successivo,
+# così la lista dei dispositivi è toccata da un solo thread.
+#
+#   GET  /status                         -> stato corrente (JSON)
+#   POST /devices   {"add": 100}         -> aggiunge N dispositivi
+#   POST /devices   {"remove": 50}       -> rimuove gli ultimi N dispositivi
+#   POST /devices   {"remove": ["MAC"]}  -> rimuove i MAC indicati
+#   POST /rate      {"hz": 20}           -> cambia la frequenza di invio
+#   POST /blackout  {"macs": ["MAC"], "ms": 2000}   -> blackout forzato
+#   POST /blackout  {"count": 10, "ms": 2000}       -> blackout su N device casuali
+
+class SimulationControl:
+    """Coda comandi condivisa fra canale di controllo, profilo di rampa e loop di simulazione."""
+    
+    def __init__(self):
+        self.commands = queue.Queue()
+        # aggiornato dal loop di simulazione, letto dal thread HTTP
+        self.status = {}
+    
+    def submit(self, cmd):
+        self.commands.put(cmd)
+    
+    def drain(self):
+        """Restituisce tutti i comandi in attesa (chiamato dal loop di simulazione)."""
+        out = []
+        while True:
+            try:
+                out.append(self.commands.get_nowait())
+            except queue.Empty:
+                return out
+
+# limite per singolo comando add: un errore di battitura non deve allocare milioni di dispositivi
+CONTROL_MAX_ADD = 10000
+MAC_RE = re.compile(r'^[0-9A-F]{12}$')
+
+def _control_macs(value):
+    """Lista di MAC (12 cifre esadecimali, senza separatori, come in server.js)."""
+    if not isinstance(value, list):
+        raise ValueError('macs deve essere una lista')
+    macs = [str(m).strip().upper() for m in value]
+    bad = [m for m in macs if not MAC_RE.match(m)]
+    if bad:
+        raise ValueError(f"MAC non validi (attese 12 cifre esadecimali): {', '.join(bad[:5])}")
+    return macs
+
+def parse_control_command(path, body):
+    """Valida una richiesta di controllo e la converte in comando; ValueError se non valida."""
+    if path == '/devices':
+        if 'add' in body:
+            n = int(body['add'])
+            if not 0 < n <= CONTROL_MAX_ADD:
+                raise ValueError(f'add deve essere fra 1 e {CONTROL_MAX_ADD}')
+            return ('add', n)
+        if 'remove' in body:
+            rem = body['remove']
+            if isinstance(rem, list):
+                return ('remove_macs', _control_macs(rem))
+            n = int(rem)
+            if n <= 0:
+                raise ValueError('remove deve essere > 0')
+            return ('remove', n)
+        raise ValueError('specificare add o remove')
+    if path == '/rate':
+        hz = float(body.get('hz', 0))
+        if not math.isfinite(hz) or hz <= 0:
+            raise ValueError('hz deve essere un numero finito > 0')
+        return ('hz', hz)
+    if path == '/blackout':
+        ms = int(body.get('ms', 0))
+        if ms <= 0:
+            raise ValueError('ms deve essere > 0')
+        if 'macs' in body:
+            return ('blackout_macs', _control_macs(body['macs']), ms)
+        n = int(body.get('count', 0))
+        if n <= 0:
+            raise ValueError('specificare macs o count')
+        return ('blackout', n, ms)
+    raise KeyError(path)
+
+def start_control_server(control, port):
+    """Avvia il server HTTP di controllo su 127.0.0.1 in un thread daemon."""
+    
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, code, obj):
+            data = json.dumps(obj).encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        
+        def do_GET(self):
+            if self.path == '/status':
+                self._reply(200, dict(control.status))
+            else:
+                self._reply(404, {'error': 'Comando sconosciuto'})
+        
+        def do_POST(self):
+            try:
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length) or b'{}')
+                cmd = parse_control_command(self.path, body)
+            except KeyError:
+                return self._reply(404, {'error': 'Comando sconosciuto'})
+            except (ValueError, TypeError) as e:
+                return self._reply(400, {'error': str(e)})
+            control.submit(cmd)
+            self._reply(200, {'ok': True, 'command': list(cmd)})
+        
+        def log_message(self, fmt, *args):
+            pass
+    
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# ---------- Profili di rampa ----------
+# File di testo, un'istruzione per riga (# per i commenti):
+#
+#   devices 100                         porta il numero di dispositivi a 100
+#   hz 20                               cambia la frequenza di invio
+#   hold 60s                            mantiene la configurazione per 60 s
+#   +100 devices every 30s up to 3000   rampa a gradini fino a 3000 dispositivi
+#   -200 devices every 10s down to 100  rampa discendente
+#   blackout 10 devices 2000ms          blackout forzato su 10 device casuali
+#   stop                                termina la simulazione
+#
+# Alla fine di ogni gradino viene stampato il throughput ottenuto.
+
+_RAMP_PATTERNS = [
+    ('ramp', re.compile(r'^([+-]\d+)\s+devices?\s+every\s+(\d+(?:\.\d+)?)\s*s\s+(?:up|down)\s+to\s+([\d,_]+)$')),
+    ('devices', re.compile(r'^devices\s+([\d,_]+)$')),
+    ('hz', re.compile(r'^hz\s+(\d+(?:\.\d+)?)$')),
+    ('hold', re.compile(r'^hold\s+(\d+(?:\.\d+)?)\s*s$')),
+    ('blackout', re.compile(r'^blackout\s+(\d+)\s+devices?\s+(\d+)\s*ms$')),
+    ('stop', re.compile(r'^stop$')),
+]
+
+def _ramp_int(txt):
+    return int(txt.replace(',', '').replace('_', ''))
+
+def parse_ramp_profile(path):
+    """Legge un profilo di rampa e restituisce la lista di istruzioni."""
+    instructions = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for lineno, raw in enumerate(f, 1):
+            line = raw.split('#', 1)[0].strip().lower()
+            if not line:
+                continue
+            for kind, rx in _RAMP_PATTERNS:
+                m = rx.match(line)
+                if not m:
+                    continue
+                if kind == 'ramp':
+                    instructions.append(('ramp', int(m.group(1)), float(m.group(2)), _ramp_int(m.group(3))))
+                elif kind == 'devices':
+                    instructions.append(('devices', _ramp_int(m.group(1))))
+                elif kind == 'hz':
+                    hz = float(m.group(1))
+                    if hz <= 0:
+                        raise ValueError(f"Profilo rampa {path}:{lineno}: hz deve essere > 0: {raw.strip()!r}")
+                    instructions.append(('hz', hz))
+                elif kind == 'hold':
+                    instructions.append(('hold', float(m.group(1))))
+                elif kind == 'blackout':
+                    instructions.append(('blackout', int(m.group(1)), int(m.group(2))))
+                else:
+                    instructions.append(('stop',))
+                break
+            else:
+                raise ValueError(f"Profilo rampa {path}:{lineno}: istruzione non valida: {raw.strip()!r}")
+    return instructions
+
+def ramp_steps(instructions, get_devices):
+    """
+    Espande le istruzioni in gradini (comandi, durata_s).
+    Le rampe sono valutate pigramente sul numero di dispositivi corrente,
+    così convivono con i comandi arrivati dal canale di controllo.
+    """
+    pending = []
+    for ins in instructions:
+        kind = ins[0]
+        if kind == 'hold':
+            yield pending, ins[1]
+            pending = []
+        elif kind == 'ramp':
+            if pending:
+                yield pending, 0.0
+                pending = []
+            _, delta, every, limit = ins
+            while True:
+                cur = get_devices()
+                if delta > 0 and cur < limit:
+                    yield [('add', min(delta, limit - cur))], every
+                elif delta < 0 and cur > limit:
+                    yield [('remove', min(-delta, cur - limit))], every
+                else:
+                    break
+        elif kind == 'devices':
+            cur = get_devices()
+            if ins[1] > cur:
+                pending.append(('add', ins[1] - cur))
+            elif ins[1] < cur:
+                pending.append(('remove', cur - ins[1]))
+        else:
+            pending.append(ins)
+    if pending:
+        yield pending, 0.0
+
+class RampRunner:
+    """Esegue un profilo di rampa e registra il throughput ottenuto a ogni gradino."""
+    
+    def __init__(self, instructions, control, get_devices, get_hz):
+        self.steps = ramp_steps(instructions, get_devices)
+        self.control = control
+        self.get_devices = get_devices
+        self.get_hz = get_hz
+        self.step_idx = 0
+        self.step_end = 0.0
+        self.step_start = None
+        self.step_sent0 = 0
+        self.step_gen0 = 0
+        self.done = False
+    
+    def tick(self, now, sent_total, generated_total):
+        if self.done or now < self.step_end:
+            return
+        if self.step_start is not None:
+            self._log_step(now, sent_total, generated_total)
+        try:
+            cmds, hold = next(self.steps)
+        except StopIteration:
+            print("[RAMP] Profilo completato")
+            self.done = True
+            return
+        for cmd in cmds:
+            self.control.submit(cmd)
+        self.step_idx += 1
+        self.step_start = now
+        self.step_end = now + hold
+        self.step_sent0 = sent_total
+        self.step_gen0 = generated_total
+    
+    def _log_step(self, now, sent_total, generated_total):
+        elapsed = now - self.step_start
+        if elapsed <= 0:
+            return
+        n, hz = self.get_devices(), self.get_hz()
+        sent_rate = (sent_total - self.step_sent0) / elapsed
+        gen_rate = (generated_total - self.step_gen0) / elapsed
+        print(f"[RAMP] Gradino {self.step_idx}: {n} dispositivi @ {hz:.1f} Hz | "
+              f"target {n * hz:.0f} pkt/s | generati {gen_rate:.0f} pkt/s | inviati {sent_rate:.0f} pkt/s "
+              f"({elapsed:.1f}s)")
+
+# ---------- Ground truth in memoria condivisa ----------
+# Tabella a layout fisso in un segmento multiprocessing.shared_memory, aggiornata
+# a ogni tick con la posizione vera di ogni dispositivo. I checker esterni la
+# leggono senza traffico di rete con GroundTruthReader.
+#
+# Header (little endian, 40 byte):
+#   magic 8s | version u32 | capacity u32 | seq u64 | count u32 | total u32 | gps_time f64
+# Record (56 byte, `capacity` slot):
+#   mac 16s | lat f64 | lon f64 | s f64 | speed_kmh f64 | lap u32 | pad u32
+#
+# seq è dispari durante la scrittura e pari a scrittura conclusa: uno snapshot
+# è consistente se seq è pari e non cambia fra inizio e fine lettura.
+# total è il numero reale di dispositivi; count = min(total, capacity).
+
+GT_MAGIC = b'RSGTRUTH'
+GT_VERSION = 1
+GT_HEADER = struct.Struct('<8sIIQIId')
+GT_RECORD = struct.Struct('<16sddddII')
+GT_SEQ = struct.Struct('<Q')
+GT_SEQ_OFFSET = 16
+
+class GroundTruthWriter:
+    """Pubblica lo stato vero dei dispositivi nel segmento condiviso (lato simulatore)."""
+    
+    def __init__(self, name, capacity):
+        self.capacity = capacity
+        self.shm = shared_memory.SharedMemory(name=name, create=True,
+                                              size=GT_HEADER.size + capacity * GT_RECORD.size)
+        self.seq = 0
+        GT_HEADER.pack_into(self.shm.buf, 0, GT_MAGIC, GT_VERSION, capacity, 0, 0, 0, 0.0)
+    
+    def publish(self, devices, positions, speeds, gps_time):
+        buf = self.shm.buf
+        count = min(len(devices), self.capacity)
+        self.seq += 1
+        GT_SEQ.pack_into(buf, GT_SEQ_OFFSET, self.seq)
+        pack = GT_RECORD.pack_into
+        off = GT_HEADER.size
+        rec = GT_RECORD.size
+        for k in range(count):
+            d = devices[k]
+            lat, lon = positions[k]
+            pack(buf, off, d.mac.encode('ascii'), lat, lon, d.s, speeds[k], d.lap, 0)
+            off += rec
+        self.seq += 1
+        GT_HEADER.pack_into(buf, 0, GT_MAGIC, GT_VERSION, self.capacity, self.seq, count, len(devices), gps_time)
+    
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+class GroundTruthReader:
+    """
+    Legge il segmento pubblicato da --shm-name (lato checker):
+
+        reader = GroundTruthReader('racesense_gt')
+        gps_time, devices = reader.snapshot()
+        # devices: {mac: (lat, lon, s, speed_kmh, lap)}
+    """
+    
+    def __init__(self, name):
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Python < 3.13: evita che il resource tracker del lettore distrugga il segmento all'uscita
+            self.shm = shared_memory.SharedMemory(name=name)
+            resource_tracker.unregister(self.shm._name, 'shared_memory')
+        magic, version, self.capacity = GT_HEADER.unpack_from(self.shm.buf, 0)[:3]
+        if magic != GT_MAGIC or version != GT_VERSION:
+            raise ValueError(f"Segmento {name} non è una tabella ground truth v{GT_VERSION}")
+    
+    def snapshot(self, timeout=1.0):
+        """
+        Restituisce (gps_time, {mac: (lat, lon, s, speed_kmh, lap)}) consistente.
+        Se la tabella è in scrittura attende (cede la CPU al writer) fino a timeout secondi.
+        """
+        buf = self.shm.buf
+        deadline = time.perf_counter() + timeout
+        backoff = 0.0
+        while True:
+            _, _, _, seq, count, _, gps_time = GT_HEADER.unpack_from(buf, 0)
+            if not seq & 1:
+                # copia in blocco e poi verifica: la finestra di lettura resta breve
+                start = GT_HEADER.size
+                raw = bytes(buf[start:start + count * GT_RECORD.size])
+                if GT_SEQ.unpack_from(buf, GT_SEQ_OFFSET)[0] == seq:
+                    return gps_time, {mac.rstrip(b'\0').decode('ascii'): (lat, lon, s, speed, lap)
+                                      for mac, lat, lon, s, speed, lap, _ in GT_RECORD.iter_unpack(raw)}
+            if time.perf_counter() >= deadline:
+                break
+            # publish() di migliaia di record dura qualche ms: prima si cede solo il turno, poi si attende
+            time.sleep(backoff)
+            backoff = min(0.001, backoff + 0.0001)
+        raise RuntimeError('Snapshot ground truth non consistente dopo troppi tentativi')
+    
+    def close(self):
+        self.shm.close()
+
+# ---------- Soak test ----------
+def parse_duration(txt):
+    """'90', '90s', '30m', '4h' -> secondi."""
+    m = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([smh]?)\s*', str(txt).lower())
+    if not m:
+        raise ValueError(f"Durata non valida: {txt!r}")
+    return float(m.group(1)) * {'': 1, 's': 1, 'm': 60, 'h': 3600}[m.group(2)]
+
+class SoakMonitor:
+    """
+    Campiona a intervalli fissi tracemalloc, RSS, GC, CPU per tick e la
+    dimensione delle strutture interne del simulatore; alla fine confronta i
+    siti di allocazione col primo campione e segnala ciò che cresce senza limite.
+
+    Il monitor non deve misurare se stesso: le allocazioni fatte dalle righe di
+    questa classe e dal modulo tracemalloc sono escluse dai siti e, insieme alla
+    memoria interna di tracemalloc, sottratte dall'RSS prima di valutarne la
+    crescita. Per ogni serie tiene solo primo/ultimo valore e numero di aumenti,
+    e segue al massimo MAX_SITES siti. tracemalloc rallenta molto il tick: la CPU
+    di riferimento è misurata sui primi BASELINE_TICKS tick, prima di avviarlo.
+    """
+    
+    TOP_SITES = 15
+    MAX_SITES = 500
+    BASELINE_TICKS = 100
+    
+    def __init__(self, duration_s, interval_s, report_path):
+        self.duration = duration_s
+        self.interval = interval_s
+        self.report_path = report_path
+        self.samples = []
+        # chiave (tipo, nome) -> [primo, ultimo, aumenti, intervalli]
+        self.growth = {}
+        self.tick_cpu = []
+        self.baseline_cpu = []
+        self.tracing = False
+        self.start = None
+        self.next_sample = None
+        self.baseline = None
+        self.own_file = SoakMonitor.sample.__code__.co_filename
+        try:
+            src, first = inspect.getsourcelines(SoakMonitor)
+            self.own_lines = range(first, first + len(src))
+        except (OSError, TypeError):
+            self.own_lines = range(0)
+    
+    @staticmethod
+    def _rss_bytes():
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, IndexError):
+            import resource
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # picco, non corrente
+    
+    @staticmethod
+    def _tick_cpu_stats(ticks):
+        ticks = sorted(ticks)
+        return {
+            'ticks': len(ticks),
+            'mean': round(sum(ticks) / len(ticks) * 1000, 3) if ticks else None,
+            'p99': round(ticks[min(len(ticks) - 1, int(len(ticks) * 0.99))] * 1000, 3) if ticks else None,
+            'max': round(ticks[-1] * 1000, 3) if ticks else None,
+        }
+    
+    def begin(self, now, probes):
+        self.start = now
+    
+    def _start_tracing(self, now, probes):
+        tracemalloc.start()
+        self.tracing = True
+        self.next_sample = now + self.interval
+        self.sample(now, probes)
+        self.baseline = tracemalloc.take_snapshot()
+    
+    def _own(self, frame):
+        """Allocazione fatta dal monitor stesso (o da tracemalloc)."""
+        return frame.filename == tracemalloc.__file__ or (
+            frame.filename == self.own_file and frame.lineno in self.own_lines)
+    
+    def _track(self, kind, name, value):
+        g = self.growth.get((kind, name))
+        if g is None:
+            # il primo campione contiene il riscaldamento (cache, code che si riempiono): non conta
+            if self.samples:
+                self.growth[(kind, name)] = [value, value, 0, 0]
+            return
+        if value > g[1]:
+            g[2] += 1
+        g[1] = value
+        g[3] += 1
+    
+    def record_tick(self, cpu_s):
+        if self.tracing:
+            self.tick_cpu.append(cpu_s)
+        else:
+            self.baseline_cpu.append(cpu_s)
+    
+    def done(self, now):
+        return now - self.start >= self.duration
+    
+    def maybe_sample(self, now, probes):
+        if not self.tracing:
+            if len(self.baseline_cpu) >= self.BASELINE_TICKS:
+                self._start_tracing(now, probes)
+        elif now >= self.next_sample:
+            self.sample(now, probes)
+            self.next_sample += self.interval
+    
+    def sample(self, now, probes):
+        snap = tracemalloc.take_snapshot()
+        own = 0
+        sites = {}
+        for st in snap.statistics('lineno'):
+            fr = st.traceback[0]
+            if self._own(fr):
+                own += st.size
+            else:
+                sites[f"{fr.filename}:{fr.lineno}"] = st.size
+        del snap
+        
+        # siti già seguiti + nuovi fra i primi 50, fino a MAX_SITES
+        tracked = {name for kind, name in self.growth if kind == 'allocation'}
+        for rank, (site, size) in enumerate(sorted(sites.items(), key=lambda kv: -kv[1])):
+            if site in tracked or (rank < 50 and len(tracked) < self.MAX_SITES):
+                tracked.add(site)
+        for site in tracked:
+            self._track('allocation', site, sites.get(site, 0))
+        
+        traced, traced_peak = tracemalloc.get_traced_memory()
+        overhead = own + tracemalloc.get_tracemalloc_memory()
+        rss = self._rss_bytes()
+        self._track('rss', 'RSS', rss - overhead)
+        for name, value in probes.items():
+            self._track('structure', name, value)
+        
+        sample = {
+            'elapsedS': round(now - self.start, 1),
+            'rssBytes': rss,
+            'monitorOverheadBytes': overhead,
+            'tracedBytes': traced - own,
+            'tracedPeakBytes': traced_peak,
+            'gcCount': list(gc.get_count()),
+            'gcCollections': [g['collections'] for g in gc.get_stats()],
+            'tickCpuMs': self._tick_cpu_stats(self.tick_cpu),
+            'structures': dict(probes),
+        }
+        self.tick_cpu = []
+        self.samples.append(sample)
+        print(f"[SOAK] t={sample['elapsedS']:.0f}s | RSS {rss / 1e6:.1f} MB (monitor {overhead / 1e6:.1f} MB) | "
+              f"traced {sample['tracedBytes'] / 1e6:.1f} MB | CPU/tick {sample['tickCpuMs']['mean']} ms | "
+              f"strutture {sample['structures']}")
+    
+    def report(self):
+        min_growth = {'structure': 0, 'rss': 1 << 20, 'allocation': 64 * 1024}
+        flagged = []
+        sites = []
+        for (kind, name), (first, last, ups, steps) in self.growth.items():
+            if kind == 'allocation':
+                sites.append({'site': name, 'first': first, 'last': last, 'growth': last - first})
+            # crescita sostenuta: ≥80% degli intervalli in aumento e crescita totale oltre la soglia
+            if steps >= 3 and ups >= 0.8 * steps and last - first > min_growth[kind]:
+                flagged.append({'kind': kind, 'name': name, 'first': first, 'last': last})
+        sites.sort(key=lambda x: -x['growth'])
+        
+        top_diff = []
+        if self.baseline is not None:
+            final = tracemalloc.take_snapshot()
+            for st in final.compare_to(self.baseline, 'lineno'):
+                fr = st.traceback[0]
+                if self._own(fr):
+                    continue
+                top_diff.append({'site': f"{fr.filename}:{fr.lineno}", 'sizeDiff': st.size_diff,
+                                 'size': st.size, 'countDiff': st.count_diff})
+                if len(top_diff) == self.TOP_SITES:
+                    break
+        
+        means = [s['tickCpuMs']['mean'] for s in self.samples if s['tickCpuMs']['mean'] is not None]
+        drift = None
+        if len(means) >= 2 and means[0]:
+            drift = round((means[-1] - means[0]) / means[0] * 100, 1)
+        return {
+            'durationS': self.samples[-1]['elapsedS'] if self.samples else 0,
+            'intervalS': self.interval,
+            # tickCpuMs dei campioni è misurato con tracemalloc attivo: confrontabile solo
+            # fra campioni; il costo reale del tick è tickCpuBaselineMs
+            'tickCpuBaselineMs': self._tick_cpu_stats(self.baseline_cpu),
+            'cpuDriftPct': drift,
+            'unbounded': flagged,
+            'topAllocationDiff': top_diff,
+            'siteGrowth': sites[:self.TOP_SITES],
+            'samples': self.samples,
+        }
+    
+    def finish(self, now, probes):
+        if not self.tracing:
+            self._start_tracing(now, probes)
+        elif self.samples[-1]['elapsedS'] < round(now - self.start, 1):
+            self.sample(now, probes)
+        rep = self.report()
+        tracemalloc.stop()
+        with open(self.report_path, 'w', encoding='utf-8') as f:
+            json.dump(rep, f, indent=2)
+        base = rep['tickCpuBaselineMs']
+        print(f"\n[SOAK] Report: {self.report_path}")
+        print(f"[SOAK] Durata {rep['durationS']:.0f}s | campioni {len(rep['samples'])} | "
+              f"CPU/tick senza tracemalloc {base['mean']} ms (p99 {base['p99']} ms) | "
+              f"deriva CPU/tick {rep['cpuDriftPct']}%")
+        if rep['unbounded']:
+            print("[SOAK] ⚠️  Crescita senza limite:")
+            for f_ in rep['unbounded']:
+                print(f"   {f_['kind']:<10} {f_['name']}: {f_['first']} → {f_['last']}")
+        else:
+            print("[SOAK] ✅ Nessuna struttura in crescita senza limite")
+        for d in rep['topAllocationDiff'][:5]:
+            print(f"   {d['sizeDiff'] / 1024:+9.1f} KiB  {d['site']}")
+
+def soak_probes(devices, net_sim, control):
+    """Dimensioni delle strutture interne da sorvegliare durante il soak."""
+    return {
+        'devices': len(devices),
+        'noise_grid_values': sum(len(d.trajectory_gen.noise_lat.values) + len(d.trajectory_gen.noise_lon.values)
+                                 for d in devices),
+        'net_state': len(net_sim.state),
+        'net_queues': len(net_sim.queues),
+        'queued_packets': net_sim.stats['current_queue_size'],
+        'stats_keys': len(net_sim.stats),
+        'control_pending': control.commands.qsize(),
+    }
+
 def run_simulation(track_file, n_devices, host, port,
                    min_kmh, max_kmh, jitter_speed=0.5, hz=15.0, loop=True,
                    max_offset=5.0, offset_frequency=50.0,
                    base_delay_ms=50, max_delay_ms=800, 
-                   spike_prob=0.03, spike_delay_ms=2000):
+                   spike_prob=0.03, spike_delay_ms=2000,
+                   control_port=None, ramp_file=None, embed_seq=False,
+                   shm_name=None, shm_capacity=4096,
+                   soak_s=None, soak_interval_s=60.0, soak_report=None, traffic=False):
     
     points = load_track_points(track_file)
     cum = cumulative_distances(points)
@@ -351,6 +1234,11 @@ def run_simulation(track_file, n_devices, host, port,
     if total_len <= 0:
         raise ValueError("Lunghezza tracciato non valida.")
     
+    # Proiezione locale calcolata una volta sola
+    track = TrackENU(points, cum)
+    
+    ramp_instructions = parse_ramp_profile(ramp_file) if ramp_file else None
+    
     # UDP socket
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     addr = (host, port)
@@ -359,21 +1247,25 @@ def run_simulation(track_file, n_devices, host, port,
     net_sim = NetworkDelaySimulator(base_delay_ms, max_delay_ms, spike_prob, spike_delay_ms)
     
     # Crea dispositivi
-    devices = []
-    base_quals = [4,5,6,7,8,9]
+    # MAC in uso: un duplicato unirebbe code, comandi e ground truth di due dispositivi
+    macs_in_use = set()
     
-    for i in range(n_devices):
-        mac = random_mac()
-        speed = random.uniform(min_kmh, max_kmh)
-        start_s = random.uniform(0, total_len)
-        sats = random.randint(10, 20)
-        qual = random.choice(base_quals)
-        cpu_temp = round(random.uniform(40.0, 75.0), 1)
-        
-        seed = random.randint(0, 1000000)
-        trajectory_gen = TrajectoryGenerator(seed, max_offset, offset_frequency)
-        
-        devices.append(Device(mac, speed, start_s, sats, qual, trajectory_gen, cpu_temp))
+    def new_device():
+        d = make_device(total_len, min_kmh, max_kmh, max_offset, offset_frequency, macs_in_use)
+        macs_in_use.add(d.mac)
+        return d
+    
+    devices = [new_device() for _ in range(n_devices)]
+    
+    # Controllo runtime e rampa
+    control = SimulationControl()
+    control_server = start_control_server(control, control_port) if control_port else None
+    ground_truth = GroundTruthWriter(shm_name, max(shm_capacity, n_devices)) if shm_name else None
+    traffic_model = TrafficModel(total_len, loop) if traffic else None
+    ramp = None
+    if ramp_instructions is not None:
+        ramp = RampRunner(ramp_instructions, control, lambda: len(devices), lambda: hz)
+    packets_generated = 0
     
     print(f"[SIM] Tracciato: {track_file}")
     print(f"[SIM] Lunghezza: {total_len:.1f} m, punti: {len(points)}")
@@ -381,11 +1273,26 @@ def run_simulation(track_file, n_devices, host, port,
     print(f"[SIM] Offset traiettoria: {max_offset:.1f} m | Frequenza variazione: {offset_frequency:.1f} m")
     print(f"[SIM] Ritardi rete: base={base_delay_ms}ms, max={max_delay_ms}ms")
     print(f"[SIM] Spike probabilità: {spike_prob*100:.1f}% | Spike ritardo: {spike_delay_ms}ms")
+    if control_server:
+        print(f"[SIM] Controllo runtime: http://127.0.0.1:{control_port}")
+    if ground_truth:
+        print(f"[SIM] Ground truth: shared memory '{shm_name}' ({ground_truth.capacity} slot)")
+    if traffic_model:
+        print(f"[SIM] Traffico: scia, sorpassi e cambi di corsia attivi")
+    if ramp_file:
+        print(f"[SIM] Profilo rampa: {ramp_file} ({len(ramp_instructions)} istruzioni)")
+    soak = None
+    if soak_s:
+        report_path = soak_report or f"soak_report_{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+        soak = SoakMonitor(soak_s, soak_interval_s, report_path)
+        print(f"[SIM] Soak: {soak_s:.0f}s, campioni ogni {soak_interval_s:.0f}s → {report_path}")
     print(f"[SIM] Premi Ctrl+C per terminare\n")
     
     dt = 1.0 / hz
     last_tick = time.perf_counter()
     last_stats_print = time.perf_counter()
+    if soak:
+        soak.begin(last_tick, soak_probes(devices, net_sim, control))
     
     try:
         while True:
@@ -399,41 +1306,104 @@ def run_simulation(track_file, n_devices, host, port,
                 elapsed = now - last_tick
             
             last_tick = now
+            cpu_tick_start = time.process_time()
+            
+            # ========== FASE 0: COMANDI DI CONTROLLO / RAMPA ==========
+            if ramp:
+                ramp.tick(now, net_sim.stats['packets_sent'], packets_generated)
+            stop = False
+            for cmd in control.drain():
+                kind = cmd[0]
+                if kind == 'add':
+                    devices.extend(new_device() for _ in range(cmd[1]))
+                elif kind == 'remove':
+                    keep = max(0, len(devices) - cmd[1])
+                    for d in devices[keep:]:
+                        net_sim.forget_device(d.mac)
+                        macs_in_use.discard(d.mac)
+                    del devices[keep:]
+                elif kind == 'remove_macs':
+                    gone = set(cmd[1])
+                    for mac in gone:
+                        net_sim.forget_device(mac)
+                        macs_in_use.discard(mac)
+                    devices = [d for d in devices if d.mac not in gone]
+                elif kind == 'hz':
+                    hz = cmd[1]
+                    dt = 1.0 / hz
+                elif kind == 'blackout':
+                    for d in random.sample(devices, min(cmd[1], len(devices))):
+                        net_sim.force_blackout(d.mac, cmd[2])
+                elif kind == 'blackout_macs':
+                    known = {d.mac for d in devices}
+                    for mac in cmd[1]:
+                        if mac in known:
+                            net_sim.force_blackout(mac, cmd[2])
+                elif kind == 'stop':
+                    stop = True
+                if traffic_model and kind in ('add', 'remove', 'remove_macs'):
+                    traffic_model.invalidate()
+                print(f"[CTRL] {' '.join(str(x) for x in cmd)} -> {len(devices)} dispositivi @ {hz:.1f} Hz")
+            if stop:
+                raise KeyboardInterrupt
             
             # ========== FASE 1: GENERA PACCHETTI GPS ==========
             # Ogni dispositivo "legge" la sua posizione GPS con timestamp corrente
             gps_read_time = time.time()  # Tempo Unix corrente (secondi)
             
-            for d in devices:
-                # Variabilità velocità
-                speed_kmh_inst = max(0.0, d.speed_kmh + random.uniform(-jitter_speed, jitter_speed))
-                
-                # Avanza lungo il tracciato
-                d.s += (speed_kmh_inst * 1000.0 / 3600.0) * elapsed
-                if d.s >= total_len:
-                    if loop:
-                        d.s %= total_len
-                    else:
-                        d.s = total_len - 1e-6
-                
-                # Posizione base sul tracciato
-                base_lat, base_lon = interpolate_on_path(points, cum, d.s)
-                
+            # 🔴 CRITICO: Timestamp GPS dal momento di lettura (NON dal momento di invio)
+            # Simula che il Raspberry abbia letto il GPS in questo preciso istante
+            # Il ritardo di rete NON influenza questo timestamp.
+            # È identico per tutti i dispositivi del tick: calcolato una volta sola.
+            timestamp_gps = ts_yyMMddHHmmss_from_time(gps_read_time)
+            ms = int((gps_read_time - int(gps_read_time)) * 1000)
+            sent_ms = int(gps_read_time * 1000)
+            
+            if traffic_model:
+                # Velocità e avanzamento decisi dall'interazione con le vetture vicine
+                traffic_model.step(devices, elapsed, jitter_speed)
+                speeds = [d.v_mps * 3.6 for d in devices]
+            else:
+                speeds = []
+                for d in devices:
+                    # Variabilità velocità
+                    speed_kmh_inst = max(0.0, d.speed_kmh + random.uniform(-jitter_speed, jitter_speed))
+                    speeds.append(speed_kmh_inst)
+                    
+                    # Avanza lungo il tracciato
+                    d.s += (speed_kmh_inst * 1000.0 / 3600.0) * elapsed
+                    if d.s >= total_len:
+                        if loop:
+                            d.s %= total_len
+                            d.lap += 1
+                        else:
+                            d.s = total_len - 1e-6
+            
+            if traffic_model:
+                # Solo offset laterale entro la corsia: niente rumore nord/est
+                offs_n = offs_e = [0.0] * len(devices)
+                lateral = traffic_model.lateral_offsets(devices)
+            else:
                 # Offset fluido per traiettoria unica
-                offset_lat_m, offset_lon_m = d.trajectory_gen.get_offset(d.s)
-                dlat, dlon = meters_to_latlon_offset(base_lat, offset_lat_m, offset_lon_m)
-                
-                lat = base_lat + dlat
-                lon = base_lon + dlon
-                
-                # 🔴 CRITICO: Timestamp GPS dal momento di lettura (NON dal momento di invio)
-                # Simula che il Raspberry abbia letto il GPS in questo preciso istante
-                # Il ritardo di rete NON influenza questo timestamp
-                timestamp_gps = ts_yyMMddHHmmss_from_time(gps_read_time)
-                ms = int((gps_read_time - int(gps_read_time)) * 1000)
-                
+                offs_n = []
+                offs_e = []
+                for d in devices:
+                    offset_lat_m, offset_lon_m = d.trajectory_gen.get_offset(d.s)
+                    offs_n.append(offset_lat_m)
+                    offs_e.append(offset_lon_m)
+                lateral = None
+            
+            # Posizioni di tutti i dispositivi sul piano locale ENU, in blocco
+            positions = track.locate_many([d.s for d in devices], offs_n, offs_e, lateral)
+            
+            for d, speed_kmh_inst, (lat, lon) in zip(devices, speeds, positions):
                 # Costruisci payload (formato server.js)
                 line = f"{d.mac}/{lat:+.7f}/{lon:+.7f}/{d.sats}/{d.qual}/{speed_kmh_inst:.1f}/{timestamp_gps}/{ms}/{d.cpu_temp:.1f}"
+                if embed_seq:
+                    # Campi extra per il load harness: sequenza per-device e timestamp di invio (epoch ms).
+                    # server.js li ignora (li legge solo col formato IMU a 23 campi).
+                    line += f"/{d.seq}/{sent_ms}"
+                    d.seq += 1
                 # print(line)
                 payload = line.encode('utf-8')
                 
@@ -441,16 +1411,40 @@ def run_simulation(track_file, n_devices, host, port,
                 # Il timestamp GPS rimane quello di "gps_read_time", 
                 # ma il pacchetto arriverà al server dopo il delay
                 net_sim.enqueue_packet(d.mac, timestamp_gps, payload)
+            packets_generated += len(devices)
+            
+            if ground_truth:
+                ground_truth.publish(devices, positions, speeds, gps_read_time)
             
             # ========== FASE 2: INVIA PACCHETTI MATURI ==========
             # Invia tutti i pacchetti il cui "tempo di invio" è scaduto
             net_sim.send_ready_packets(sock, addr)
             
+            control.status = {
+                'devices': len(devices),
+                'hz': hz,
+                'packets_generated': packets_generated,
+                **net_sim.stats,
+            }
+            if traffic_model:
+                control.status['overtakes'] = traffic_model.overtakes
+                control.status['following'] = traffic_model.following
+            
+            if soak:
+                soak.record_tick(time.process_time() - cpu_tick_start)
+                soak.maybe_sample(now, soak_probes(devices, net_sim, control))
+                if soak.done(now):
+                    print("[SOAK] Durata raggiunta")
+                    raise KeyboardInterrupt
+            
             # ========== FASE 3: STATISTICHE (ogni 5 secondi) ==========
             if now - last_stats_print >= 5.0:
                 stats = net_sim.get_stats()
                 print(f"[STATS] Queue: {stats['current_queue_size']}/{stats['max_queue_size']} | "
                       f"Sent: {stats['packets_sent']} | Spikes: {stats['spikes_triggered']}")
+                if traffic_model:
+                    print(f"[TRAFFIC] Sorpassi: {traffic_model.overtakes} | Tentativi: {traffic_model.attempts} | "
+                          f"In scia ora: {traffic_model.following}/{len(devices)}")
                 last_stats_print = now
     
     except KeyboardInterrupt:
@@ -478,6 +1472,12 @@ def run_simulation(track_file, n_devices, host, port,
         print(f"  Coda max:           {final_stats['max_queue_size']}")
     
     finally:
+        if soak:
+            soak.finish(time.perf_counter(), soak_probes(devices, net_sim, control))
+        if control_server:
+            control_server.shutdown()
+        if ground_truth:
+            ground_truth.close()
         sock.close()
         print("[SIM] Terminato.")
 
@@ -498,6 +1498,11 @@ Esempi d'uso:
   # Rete ottima (ritardi minimi)
   python3 tracksimulator.py --file data/circuiti/2025-10-23T13-39-40-000Z__tracciato-ferrara-gara.json --devices 20 \\
       --base-delay-ms 20 --max-delay-ms 100 --spike-prob 0.01
+
+  # Ricerca punto di saturazione: rampa a gradini + controllo runtime
+  python3 tracksimulator.py --file data/circuiti/2025-10-23T13-39-40-000Z__tracciato-ferrara-gara.json --devices 100 \\
+      --ramp ramp.txt --control-port 8899
+  curl -X POST localhost:8899/blackout -d '{"count": 20, "ms": 3000}'
         """
     )
     
@@ -522,6 +1527,8 @@ Esempi d'uso:
     # Parametri traiettoria
     ap.add_argument('--no-loop', action='store_true', 
                     help='Non loop sul tracciato')
+    ap.add_argument('--traffic', action='store_true',
+                    help='Dispositivi interagenti: scia, distanza di sicurezza, sorpassi e cambi di corsia')
     ap.add_argument('--max-offset', type=float, default=5.0, 
                     help='Offset max traiettoria metri (default: 5.0)')
     ap.add_argument('--offset-freq', type=float, default=50.0, 
@@ -536,8 +1543,35 @@ Esempi d'uso:
                     help='Probabilità spike ritardo 0-1 (default: 0.02)')
     ap.add_argument('--spike-delay-ms', type=int, default=1000, 
                     help='Ritardo spike ms (default: 800)')    
+    
+    # Controllo runtime
+    ap.add_argument('--control-port', type=int, default=None,
+                    help='Porta HTTP di controllo su 127.0.0.1 (default: disabilitato)')
+    ap.add_argument('--ramp', default=None,
+                    help='File profilo di rampa da eseguire automaticamente')
+    ap.add_argument('--embed-seq', action='store_true',
+                    help='Aggiunge sequenza e timestamp di invio ai pacchetti (per loadharness.py)')
+    ap.add_argument('--shm-name', default=None,
+                    help='Pubblica la ground truth per dispositivo in shared memory con questo nome')
+    ap.add_argument('--shm-capacity', type=int, default=4096,
+                    help='Slot della tabella ground truth (default: 4096)')
+    ap.add_argument('--soak', type=parse_duration, default=None, metavar='DURATION',
+                    help='Soak test di lunga durata (es. 4h, 30m): memoria, GC e CPU campionati e report finale')
+    ap.add_argument('--soak-interval', type=parse_duration, default=60.0, metavar='DURATION',
+                    help='Intervallo di campionamento del soak (default: 60s)')
+    ap.add_argument('--soak-report', default=None,
+                    help='File JSON del report soak (default: soak_report_<data>.json)')
+    ap.add_argument('--check-enu', action='store_true',
+                    help='Misura l\'errore della proiezione ENU rispetto al calcolo sferico ed esce')
     args = ap.parse_args()
     
+    if args.check_enu:
+        points = load_track_points(args.file)
+        cum = cumulative_distances(points)
+        worst, mean = enu_max_error_m(points, cum, offset_m=args.max_offset)
+        print(f"[ENU] {args.file}: lunghezza {cum[-1]:.1f} m | errore max {worst*1000:.3f} mm | medio {mean*1000:.3f} mm")
+        return
+    
     # Validazione
     if args.devices <= 0:
         print("❌ Numero dispositivi deve essere > 0", file=sys.stderr)
@@ -555,6 +1589,11 @@ Esempi d'uso:
         print("❌ spike-prob deve essere tra 0.0 e 1.0", file=sys.stderr)
         sys.exit(2)
     
+    # SIGTERM come Ctrl+C: flush delle code e rilascio della shared memory
+    def _sigterm(_signum, _frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, _sigterm)
+    
     # Esegui simulazione
     run_simulation(
         track_file=args.file,
@@ -570,7 +1609,16 @@ Esempi d'uso:
         base_delay_ms=args.base_delay_ms,
         max_delay_ms=args.max_delay_ms,
         spike_prob=args.spike_prob,
-        spike_delay_ms=args.spike_delay_ms
+        spike_delay_ms=args.spike_delay_ms,
+        control_port=args.control_port,
+        ramp_file=args.ramp,
+        embed_seq=args.embed_seq,
+        shm_name=args.shm_name,
+        shm_capacity=args.shm_capacity,
+        soak_s=args.soak,
+        soak_interval_s=args.soak_interval,
+        soak_report=args.soak_report,
+        traffic=args.traffic
     )
 
 if __name__ == '__main__':
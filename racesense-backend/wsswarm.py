@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+# wsswarm.py
+#
+# Sciame di spettatori WebSocket (asyncio) per misurare il fan-out live del
+# backend (broadcast telemetry ~15Hz + snapshot 1Hz su :5001) con centinaia di
+# dashboard connesse durante una gara.
+#
+# - Apre N connessioni WebSocket concorrenti (client RFC 6455 minimale, con
+#   permessage-deflate come i browser) e marca l'istante di ricezione di ogni frame
+# - Un relay UDP locale si mette fra simulatore e backend e registra l'istante di
+#   invio di ogni posizione: la latenza di fan-out è misurata dall'invio UDP alla
+#   ricezione WebSocket della stessa posizione (jitter buffer incluso)
+# - Riporta per client il ritardo rispetto al ts del frame (backlog), i frame
+#   saltati per backpressure e le disconnessioni
+#
+# Tutto gira su localhost.
+#
+# Uso (backend già avviato con `npm start`):
+#   python3 wsswarm.py --clients 300 --duration 60 --start-race <circuitId> \
+#       -- --file data/circuiti/<ID>.json --devices 20 --hz 15
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import math
+import os
+import struct
+import subprocess
+import sys
+import time
+import urllib.request
+import zlib
+
+from loadharness import percentile
+
+SIMULATOR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tracksimulator.py')
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+TELEMETRY_INTERVAL_MS = 33  # setInterval dello scheduler telemetry in server.js
+
+def pos_key(mac, lat, lon):
+    """Chiave posizione allineata a round6() di minimalPositions (Math.round(x*1e6))."""
+    return (mac, math.floor(lat * 1e6 + 0.5), math.floor(lon * 1e6 + 0.5))
+
+# ---------- Client WebSocket minimale ----------
+class ConnectionClosed(Exception):
+    pass
+
+class WSClient:
+    """Client RFC 6455 essenziale: handshake, frame frammentati, ping/pong, permessage-deflate."""
+
+    def __init__(self, reader, writer, deflate, reset_context):
+        self.reader = reader
+        self.writer = writer
+        self.deflate = deflate
+        self.reset_context = reset_context
+        self._inflate = zlib.decompressobj(-zlib.MAX_WBITS)
+
+    @classmethod
+    async def connect(cls, host, port, path='/', deflate=True):
+        reader, writer = await asyncio.open_connection(host, port)
+        key = base64.b64encode(os.urandom(16)).decode()
+        lines = [
+            f"GET {path} HTTP/1.1",
+            f"Host: {host}:{port}",
+            "Upgrade: websocket",
+            "Connection: Upgrade",
+            f"Sec-WebSocket-Key: {key}",
+            "Sec-WebSocket-Version: 13",
+        ]
+        if deflate:
+            lines.append("Sec-WebSocket-Extensions: permessage-deflate; client_max_window_bits")
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode())
+        head = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1').split('\r\n')
+        if ' 101 ' not in head[0] + ' ':
+            writer.close()
+            raise ConnectionClosed(f"handshake rifiutato: {head[0]}")
+        headers = {}
+        for h in head[1:]:
+            if ':' in h:
+                k, v = h.split(':', 1)
+                headers[k.strip().lower()] = v.strip()
+        expected = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+        if headers.get('sec-websocket-accept') != expected:
+            writer.close()
+            raise ConnectionClosed('Sec-WebSocket-Accept non valido')
+        ext = headers.get('sec-websocket-extensions', '')
+        return cls(reader, writer, 'permessage-deflate' in ext, 'server_no_context_takeover' in ext)
+
+    def _send_frame(self, opcode, payload=b''):
+        mask = os.urandom(4)
+        n = len(payload)
+        if n < 126:
+            head = struct.pack('!BB', 0x80 | opcode, 0x80 | n)
+        elif n < 65536:
+            head = struct.pack('!BBH', 0x80 | opcode, 0x80 | 126, n)
+        else:
+            head = struct.pack('!BBQ', 0x80 | opcode, 0x80 | 127, n)
+        masked = bytes(b ^ mask[i & 3] for i, b in enumerate(payload))
+        self.writer.write(head + mask + masked)
+
+    async def recv(self):
+        """Restituisce il prossimo messaggio dati (bytes); ConnectionClosed alla chiusura."""
+        chunks = []
+        compressed = False
+        while True:
+            try:
+                b0, b1 = await self.reader.readexactly(2)
+                n = b1 & 0x7F
+                if n == 126:
+                    n = struct.unpack('!H', await self.reader.readexactly(2))[0]
+                elif n == 127:
+                    n = struct.unpack('!Q', await self.reader.readexactly(8))[0]
+                mask = await self.reader.readexactly(4) if b1 & 0x80 else None
+                payload = await self.reader.readexactly(n)
+            except (asyncio.IncompleteReadError, ConnectionError) as e:
+                raise ConnectionClosed(f"connessione persa: {e.__class__.__name__}")
+            if mask:
+                payload = bytes(b ^ mask[i & 3] for i, b in enumerate(payload))
+            opcode = b0 & 0x0F
+            if opcode == 0x9:  # ping
+                self._send_frame(0xA, payload)
+                continue
+            if opcode == 0xA:  # pong
+                continue
+            if opcode == 0x8:  # close
+                code = struct.unpack('!H', payload[:2])[0] if len(payload) >= 2 else 1005
+                raise ConnectionClosed(f"chiusura dal server ({code})")
+            if opcode in (0x1, 0x2):
+                chunks = [payload]
+                compressed = bool(b0 & 0x40)
+            else:
+                chunks.append(payload)
+            if b0 & 0x80:
+                break
+        data = b''.join(chunks)
+        if compressed and self.deflate:
+            data = self._inflate.decompress(data + b'\x00\x00\xff\xff')
+            if self.reset_context:
+                self._inflate = zlib.decompressobj(-zlib.MAX_WBITS)
+        return data
+
+    async def close(self):
+        try:
+            self._send_frame(0x8, struct.pack('!H', 1000))
+            await self.writer.drain()
+        except ConnectionError:
+            pass
+        self.writer.close()
+
+# ---------- Relay UDP ----------
+class UDPRelay(asyncio.DatagramProtocol):
+    """Inoltra i pacchetti del simulatore al backend registrando l'istante di invio per posizione."""
+
+    def __init__(self, target, retention_s=60.0):
+        self.target = target
+        self.retention = retention_s
+        self.sent_at = {}
+        self.macs = set()
+        self.packets = 0
+        self._last_prune = time.time()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        now = time.time()
+        self.transport.sendto(data, self.target)
+        self.packets += 1
+        parts = data.decode('utf-8', 'replace').strip().split('/')
+        if len(parts) >= 3:
+            try:
+                mac = parts[0].upper()
+                key = pos_key(mac, float(parts[1]), float(parts[2]))
+            except ValueError:
+                return
+            self.macs.add(mac)
+            self.sent_at.setdefault(key, now)
+        if now - self._last_prune > self.retention:
+            cutoff = now - self.retention
+            self.sent_at = {k: v for k, v in self.sent_at.items() if v >= cutoff}
+            self._last_prune = now
+
+# ---------- Spettatore ----------
+class Spectator:
+    """Una dashboard simulata: riceve e marca i frame, opzionalmente legge lentamente."""
+
+    def __init__(self, idx, slow_read_ms=0):
+        self.idx = idx
+        self.slow_read = slow_read_ms / 1000.0
+        self.frames = {}
+        self.bytes = 0
+        self.lag_ms = []
+        self.fanout_ms = []
+        self.skipped = 0
+        self.last_telemetry_ts = None
+        self.last_pos = {}
+        self.connected_at = None
+        self.disconnected_at = None
+        self.disconnect_reason = None
+
+    async def run(self, host, port, relay, deadline, deflate):
+        try:
+            ws = await WSClient.connect(host, port, deflate=deflate)
+        except (OSError, ConnectionClosed) as e:
+            self.disconnect_reason = f"connessione fallita: {e}"
+            return
+        self.connected_at = time.time()
+        try:
+            while True:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    data = await asyncio.wait_for(ws.recv(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                self._on_message(data, time.time(), relay)
+                if self.slow_read:
+                    await asyncio.sleep(self.slow_read)
+        except ConnectionClosed as e:
+            self.disconnected_at = time.time()
+            self.disconnect_reason = str(e)
+            return
+        await ws.close()
+
+    def _on_message(self, data, now, relay):
+        self.bytes += len(data)
+        try:
+            msg = json.loads(data)
+        except ValueError:
+            self.frames['invalid'] = self.frames.get('invalid', 0) + 1
+            return
+        kind = msg.get('type', '?')
+        self.frames[kind] = self.frames.get(kind, 0) + 1
+        if kind != 'telemetry':
+            return
+        ts = msg.get('ts')
+        if ts:
+            self.lag_ms.append(now * 1000 - ts)
+            # frame saltati: il server non invia ai client con bufferedAmount alto
+            if self.last_telemetry_ts and ts - self.last_telemetry_ts > 2 * TELEMETRY_INTERVAL_MS:
+                self.skipped += int((ts - self.last_telemetry_ts) / TELEMETRY_INTERVAL_MS) - 1
+            self.last_telemetry_ts = ts
+        if relay is None:
+            return
+        for d in msg.get('drivers') or []:
+            try:
+                key = pos_key(d['mac'], d['lat'], d['lon'])
+            except (KeyError, TypeError):
+                continue
+            # la telemetria ripete l'ultima posizione: misura solo le posizioni nuove
+            if self.last_pos.get(d['mac']) == key:
+                continue
+            self.last_pos[d['mac']] = key
+            sent = relay.sent_at.get(key)
+            if sent is not None:
+                self.fanout_ms.append((now - sent) * 1000)
+
+# ---------- Gara ----------
+def http_json(url, body=None):
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(url, data=data, method='POST' if data is not None else 'GET',
+                                 headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(req, timeout=10) as r:
+        return json.loads(r.read() or b'null')
+
+def start_race(api, circuit_id, macs):
+    """Avvia una gara assegnando i MAC visti dal relay ai piloti esistenti (a rotazione)."""
+    pilots = http_json(f"{api}/api/pilots")
+    if not pilots:
+        raise RuntimeError('Nessun pilota in /api/pilots')
+    assignments = {mac: pilots[i % len(pilots)]['id'] for i, mac in enumerate(sorted(macs))}
+    return http_json(f"{api}/api/race/start", {
+        'circuitId': circuit_id, 'totalLaps': 999, 'assignments': assignments, 'pilots': pilots,
+    })
+
+# ---------- Report ----------
+def _pcts(vals):
+    s = sorted(vals)
+    return {'p50': percentile(s, 50), 'p99': percentile(s, 99), 'p999': percentile(s, 99.9),
+            'max': s[-1] if s else None}
+
+def build_report(spectators, relay, duration):
+    # i percentili aggregati escludono i client lenti, riportati singolarmente
+    normal = [s for s in spectators if not s.slow_read] or spectators
+    fanout = [v for s in normal for v in s.fanout_ms]
+    lag = [v for s in normal for v in s.lag_ms]
+    per_client = []
+    for s in spectators:
+        lag_sorted = sorted(s.lag_ms)
+        per_client.append({
+            'client': s.idx,
+            'slow': bool(s.slow_read),
+            'frames': s.frames,
+            'bytes': s.bytes,
+            'lagP99Ms': percentile(lag_sorted, 99),
+            'lagMaxMs': lag_sorted[-1] if lag_sorted else None,
+            'skippedFrames': s.skipped,
+            'disconnected': s.disconnect_reason,
+        })
+    return {
+        'clients': len(spectators),
+        'durationS': duration,
+        'udpPackets': relay.packets if relay else None,
+        'fanoutLatencyMs': _pcts(fanout),
+        'frameLagMs': _pcts(lag),
+        'telemetryFrames': sum(s.frames.get('telemetry', 0) for s in spectators),
+        'bytesReceived': sum(s.bytes for s in spectators),
+        'skippedFrames': sum(s.skipped for s in spectators),
+        'disconnects': sum(1 for s in spectators if s.disconnect_reason),
+        'perClient': per_client,
+    }
+
+def _fmt(v):
+    return f"{v:8.1f}" if v is not None else "       -"
+
+def print_report(rep):
+    f, l = rep['fanoutLatencyMs'], rep['frameLagMs']
+    print(f"\n[SWARM] Client: {rep['clients']} | durata {rep['durationS']:.0f}s | pacchetti UDP: {rep['udpPackets']}")
+    print(f"  Fan-out UDP→WS ms : p50 {_fmt(f['p50'])} p99 {_fmt(f['p99'])} p999 {_fmt(f['p999'])} max {_fmt(f['max'])}")
+    print(f"  Ritardo frame ms  : p50 {_fmt(l['p50'])} p99 {_fmt(l['p99'])} p999 {_fmt(l['p999'])} max {_fmt(l['max'])}")
+    print(f"  Frame telemetry   : {rep['telemetryFrames']} | MB ricevuti: {rep['bytesReceived'] / 1e6:.1f}")
+    print(f"  Frame saltati     : {rep['skippedFrames']} | Disconnessioni: {rep['disconnects']}")
+    worst = sorted(rep['perClient'], key=lambda c: -(c['lagP99Ms'] or 0))[:5]
+    if worst:
+        print("  Client più in ritardo (backlog):")
+        for c in worst:
+            print(f"    #{c['client']:<4} {'lento ' if c['slow'] else ''}lag p99 {_fmt(c['lagP99Ms'])} ms | "
+                  f"saltati {c['skippedFrames']} | {c['disconnected'] or 'connesso'}")
+
+# ---------- Main ----------
+async def run_swarm(args, sim_args):
+    loop = asyncio.get_running_loop()
+    relay = None
+    transport = None
+    sim = None
+    started_race = False
+    api = args.api.rstrip('/')
+    try:
+        if args.relay_port:
+            host, port = args.udp_target.rsplit(':', 1)
+            transport, relay = await loop.create_datagram_endpoint(
+                lambda: UDPRelay((host, int(port))), local_addr=('127.0.0.1', args.relay_port))
+            print(f"[SWARM] Relay UDP 127.0.0.1:{args.relay_port} → {args.udp_target}")
+        if sim_args:
+            if not relay:
+                raise SystemExit("❌ Il simulatore richiede il relay (--relay-port)")
+            cmd = [sys.executable, SIMULATOR] + sim_args + ['--host', '127.0.0.1', '--port', str(args.relay_port)]
+            sim = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            print(f"[SWARM] Simulatore avviato (PID {sim.pid})")
+        if args.start_race:
+            await asyncio.sleep(args.warmup)
+            if not relay or not relay.macs:
+                raise SystemExit("❌ Nessun MAC visto dal relay: impossibile assegnare i piloti")
+            await asyncio.to_thread(start_race, api, args.start_race, relay.macs)
+            started_race = True
+            print(f"[SWARM] Gara avviata su {args.start_race} con {len(relay.macs)} dispositivi")
+
+        host, port = args.ws.replace('ws://', '').split('/')[0].rsplit(':', 1)
+        deadline = time.perf_counter() + args.duration
+        spectators = [Spectator(i, args.slow_read_ms if i < args.slow_clients else 0)
+                      for i in range(args.clients)]
+        tasks = []
+        for i, s in enumerate(spectators):
+            tasks.append(asyncio.create_task(s.run(host, int(port), relay, deadline, not args.no_deflate)))
+            if args.connect_ramp > 0:
+                await asyncio.sleep(args.connect_ramp / args.clients)
+        print(f"[SWARM] {args.clients} client connessi a {args.ws} ({args.slow_clients} lenti)")
+        await asyncio.gather(*tasks)
+        return build_report(spectators, relay, args.duration)
+    finally:
+        if started_race:
+            try:
+                await asyncio.to_thread(http_json, f"{api}/api/race/stop", {})
+            except OSError as e:
+                print(f"[SWARM] Errore stop gara: {e}")
+        if sim and sim.poll() is None:
+            sim.terminate()
+            sim.wait()
+        if transport:
+            transport.close()
+
+def main():
+    ap = argparse.ArgumentParser(
+        description="Sciame di client WebSocket per il load test del broadcast live",
+        epilog="Gli argomenti dopo -- avviano tracksimulator.py verso il relay (es. -- --file <tracciato> --devices 20)"
+    )
+    ap.add_argument('--ws', default='ws://127.0.0.1:5001', help='URL WebSocket (default: ws://127.0.0.1:5001)')
+    ap.add_argument('--api', default='http://127.0.0.1:5000', help='URL API REST (default: http://127.0.0.1:5000)')
+    ap.add_argument('--clients', type=int, default=100, help='Numero di client WebSocket (default: 100)')
+    ap.add_argument('--duration', type=float, default=30.0, help='Durata misura in secondi (default: 30)')
+    ap.add_argument('--connect-ramp', type=float, default=2.0,
+                    help='Secondi su cui distribuire le connessioni (default: 2)')
+    ap.add_argument('--slow-clients', type=int, default=0,
+                    help='Quanti client leggono lentamente per stressare la backpressure (default: 0)')
+    ap.add_argument('--slow-read-ms', type=float, default=200.0,
+                    help='Pausa fra due letture dei client lenti (default: 200)')
+    ap.add_argument('--no-deflate', action='store_true', help='Non negoziare permessage-deflate')
+    ap.add_argument('--relay-port', type=int, default=8887,
+                    help='Porta del relay UDP per la latenza di fan-out, 0 per disabilitare (default: 8887)')
+    ap.add_argument('--udp-target', default='127.0.0.1:8888', help='Porta UDP del backend (default: 127.0.0.1:8888)')
+    ap.add_argument('--start-race', metavar='CIRCUIT_ID', default=None,
+                    help='Avvia (e poi ferma) una gara assegnando ai piloti i MAC visti dal relay')
+    ap.add_argument('--warmup', type=float, default=3.0,
+                    help='Secondi di traffico prima di avviare la gara (default: 3)')
+    ap.add_argument('--json', default=None, help='Salva il report completo in JSON')
+    ap.add_argument('sim_args', nargs=argparse.REMAINDER)
+    args = ap.parse_args()
+
+    sim_args = args.sim_args[1:] if args.sim_args[:1] == ['--'] else args.sim_args
+    if args.clients <= 0 or args.duration <= 0:
+        print("❌ Numero client e durata devono essere > 0", file=sys.stderr)
+        sys.exit(2)
+
+    try:
+        rep = asyncio.run(run_swarm(args, sim_args))
+    except KeyboardInterrupt:
+        print("\n[SWARM] Interrotto.")
+        return
+    print_report(rep)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(rep, f, indent=2)
+        print(f"\n[SWARM] Report salvato in {args.json}")
+
+if __name__ == '__main__':
+    main()